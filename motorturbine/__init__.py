@@ -1,5 +1,7 @@
-from . import errors, connection, fields
+from . import errors, connection, fields, indexes
 from .document import BaseDocument
+from .unit import unit_of_work
+from .buffer import WriteBuffer
 
 __version__ = '0.5.0'
 name = 'motorturbine'
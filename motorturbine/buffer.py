@@ -0,0 +1,341 @@
+from . import errors, updateset, utils
+import asyncio
+import collections
+import logging
+import time
+from pymongo import UpdateOne
+from pymongo import errors as pymongo_errors
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBuffer(object):
+    """Collects :class:`~motorturbine.updateset.Inc`,
+    :class:`~motorturbine.updateset.Dec`,
+    :class:`~motorturbine.updateset.Max` and
+    :class:`~motorturbine.updateset.Min` operators for saved documents in
+    memory and writes them later with one unordered bulk write per
+    collection. Operators for the same field of the same document are
+    combined, so a thousand increments of a counter only cost a single
+    update. Fields that received operators which can not be combined,
+    e.g. an Inc followed by a Max, are updated in order instead.
+
+    >>> views = WriteBuffer(interval=5)
+    >>> views.add(page, 'views', Inc(1))
+    ...
+    >>> await views.close()
+
+    The buffer is written after ``interval`` seconds have passed since the
+    first buffered operator or as soon as ``max_size`` fields are buffered.
+    The documents themselves are not changed and do not see the buffered
+    operators until they are reloaded. Operators that were not written
+    yet are lost if the application stops without calling :meth:`close`.
+
+    Operators whose update failed are buffered again and written with
+    the next write, the others are not sent twice. Once the update of a
+    field failed more than ``max_retries`` times in a row its operators
+    are dropped. If the whole write failed, e.g. because the connection
+    was lost, all of its operators are buffered again. Failures of
+    writes that were started by the interval or the size limit are
+    logged, failures of :meth:`flush` and :meth:`close` are raised.
+
+    Every write creates a dict of metrics which is kept as ``last_flush``
+    and passed to ``on_flush`` if given:
+
+        * operators - The amount of operators that were added
+        * fields - The amount of fields that were updated
+        * documents - The amount of documents that were updated
+        * updates - The amount of update queries that were sent
+        * matched - The amount of documents that matched the queries
+        * modified - The amount of documents that were modified
+        * failed - The amount of update queries that failed
+        * dropped - The amount of fields whose operators were dropped
+        * duration - The duration of the write in seconds
+
+    :param float interval: optional *(1.0)* –
+        The seconds after which buffered operators are written,
+        None only writes them on :meth:`flush`.
+    :param int max_size: optional *(1000)* –
+        The amount of buffered fields that causes a write,
+        None disables the limit.
+    :param on_flush: optional *(None)* –
+        A function that receives the metrics of every write.
+    :param int max_retries: optional *(3)* –
+        How often the operators of a field whose update failed are
+        written again, None retries them until they were written.
+    """
+    operators = (updateset.Inc, updateset.Dec, updateset.Max, updateset.Min)
+
+    def __init__(
+            self, interval=1.0, max_size=1000, on_flush=None, max_retries=3):
+        super().__init__()
+        self.interval = interval
+        self.max_size = max_size
+        self.on_flush = on_flush
+        self.max_retries = max_retries
+        self.last_flush = None
+
+        self.pending = collections.OrderedDict()
+        self.added = 0
+        self.timer = None
+        self.tasks = set()
+        self.retries = {}
+        # a started write takes all operators that were buffered until then
+        self.scheduled = False
+
+    def add(self, doc, path, operator):
+        """Buffers an operator for a field of a saved document.
+
+        :param BaseDocument doc: The document to update
+        :param str path: The name or path of the field, e.g. ``stats.views``
+        :param UpdateOperator operator: The operator to apply
+
+        :raises TypeMismatch: If the operator can not be buffered
+        :raises FieldNotFound: On a non-existent field
+        :raises ValueError: If the document was not saved yet
+        """
+        if doc.id is None or doc._parent is not None:
+            raise ValueError('{!r} was not saved yet.'.format(doc))
+        self.add_by_id(type(doc), doc.id, path, operator)
+
+    def add_by_id(self, document, oid, path, operator):
+        """Buffers an operator for a field of the document with the
+        given id without loading it.
+
+        >>> views.add_by_id(Page, page_id, 'views', Inc(1))
+
+        :param document: The document class
+        :param ObjectId oid: The id of the document
+        :param str path: The name or path of the field
+        :param UpdateOperator operator: The operator to apply
+
+        :raises TypeMismatch: If the operator can not be buffered or does
+            not fit the field
+        :raises FieldNotFound: On a non-existent field
+        """
+        if not isinstance(operator, self.operators):
+            raise errors.TypeMismatch(self.operators, type(operator))
+        field = utils.field_by_path(document, path)
+        utils.validate_operator(field, operator)
+
+        _append(self.pending.setdefault((document, oid, path), []), operator)
+        self.added += 1
+
+        if self.max_size is not None and len(self.pending) >= self.max_size:
+            self._schedule(0)
+        elif self.interval is not None:
+            self._schedule(self.interval)
+
+    def _schedule(self, delay):
+        loop = asyncio.get_event_loop()
+        if delay == 0:
+            self._cancel_timer()
+            if self.scheduled:
+                return
+            self.scheduled = True
+            task = asyncio.ensure_future(self.flush(), loop=loop)
+            self.tasks.add(task)
+            task.add_done_callback(self._flush_done)
+        elif self.timer is None:
+            self.timer = loop.call_later(delay, self._schedule, 0)
+
+    def _flush_done(self, task):
+        self.tasks.discard(task)
+        if task.cancelled() or task.exception() is None:
+            return
+        logger.error(
+            'Writing the buffered operators failed, they are written again '
+            'with the next write.', exc_info=task.exception())
+
+    def _requeue(self, failed, errored=()):
+        # fields whose update failed too often are dropped
+        dropped = set()
+        for key in errored:
+            self.retries[key] = self.retries.get(key, 0) + 1
+            if self.max_retries is not None and (
+                    self.retries[key] > self.max_retries):
+                dropped.add(key)
+                del self.retries[key]
+        if len(dropped) != 0:
+            logger.error(
+                'Dropped the buffered operators of %s after %s failed '
+                'writes.', ', '.join(
+                    '{}.{} of {}'.format(document.__name__, path, oid)
+                    for document, oid, path in dropped),
+                self.max_retries + 1)
+
+        # failed operators are written before the ones that were
+        # added in the meantime
+        pending = collections.OrderedDict()
+        for key, op in failed:
+            if key not in dropped:
+                _append(pending.setdefault(key, []), op)
+        for key, ops in self.pending.items():
+            queued = pending.setdefault(key, [])
+            for op in ops:
+                _append(queued, op)
+        self.pending = pending
+
+        if self.interval is not None:
+            self._schedule(self.interval)
+        return len(dropped)
+
+    def _cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    async def flush(self):
+        """Writes all buffered operators and returns the metrics of the
+        write. Operators that are added during the write are buffered
+        for the next one. Returns None if no operators were buffered.
+
+        :raises PyMongoError: If a write failed, after the operators that
+            were not written were buffered again
+        """
+        self._cancel_timer()
+        self.scheduled = False
+        if len(self.pending) == 0:
+            return None
+
+        pending = self.pending
+        added = self.added
+        self.pending = collections.OrderedDict()
+        self.added = 0
+
+        grouped = collections.OrderedDict()
+        for (document, oid, path), ops in pending.items():
+            paths = grouped.setdefault(document, collections.OrderedDict())
+            paths.setdefault(oid, []).append((path, ops))
+
+        start = time.monotonic()
+        results = await asyncio.gather(*[
+            self._flush_collection(document, docs)
+            for document, docs in grouped.items()
+        ], return_exceptions=True)
+        failures = [
+            result for result in results if isinstance(result, Exception)]
+        results = [result for result in results if isinstance(result, dict)]
+        failures.extend(
+            result['error'] for result in results
+            if result['error'] is not None)
+
+        metrics = {
+            'operators': added,
+            'fields': len(pending),
+            'documents': sum(len(docs) for docs in grouped.values()),
+            'updates': sum(result['updates'] for result in results),
+            'matched': sum(result['matched'] for result in results),
+            'modified': sum(result['modified'] for result in results),
+            'failed': sum(result['failed'] for result in results),
+            'dropped': sum(result['dropped'] for result in results),
+            'duration': time.monotonic() - start
+        }
+        self.last_flush = metrics
+        if self.on_flush is not None:
+            self.on_flush(metrics)
+
+        if len(failures) != 0:
+            raise failures[0]
+        return metrics
+
+    async def _flush_collection(self, document, docs):
+        update_queries = []
+        sources = []
+        ordered = False
+        for oid, paths in docs.items():
+            # operators of overlapping fields are sent with later updates
+            rounds = []
+            for path, ops in paths:
+                index = 0
+                for op in ops:
+                    while index < len(rounds) and any(
+                            utils.paths_overlap(path, other)
+                            for other in rounds[index][1]):
+                        index += 1
+                    if index == len(rounds):
+                        rounds.append(({}, [], []))
+                    name, value = op()
+                    rounds[index][0].setdefault(name, {})[path] = value
+                    rounds[index][1].append(path)
+                    rounds[index][2].append(((document, oid, path), op))
+                    index += 1
+
+            for update, _, source in rounds:
+                update_queries.append(UpdateOne({'_id': oid}, update))
+                sources.append(source)
+            ordered = ordered or len(rounds) > 1
+
+        # the updates of a document have to be applied in order
+        coll = document._get_write_collection()
+        bypass = document._options['bypass_document_validation']
+        counts = {
+            'updates': len(update_queries), 'matched': 0, 'modified': 0,
+            'failed': 0, 'dropped': 0, 'error': None}
+        try:
+            result = await coll.bulk_write(
+                update_queries, ordered=ordered,
+                bypass_document_validation=bypass)
+        except pymongo_errors.BulkWriteError as e:
+            errored = set(
+                error['index'] for error in e.details['writeErrors'])
+            failed = set(errored)
+            if ordered and len(failed) != 0:
+                # the updates after the first failure were not sent
+                failed.update(range(min(failed), len(update_queries)))
+            self._written([
+                source for index, source in enumerate(sources)
+                if index not in failed])
+            counts['dropped'] = self._requeue(
+                [item for index in sorted(failed) for item in sources[index]],
+                set(key for index in errored for key, _ in sources[index]))
+
+            counts['matched'] = e.details.get('nMatched', 0)
+            counts['modified'] = e.details.get('nModified', 0)
+            counts['failed'] = len(failed)
+            counts['error'] = e
+            return counts
+        except Exception:
+            self._requeue([item for source in sources for item in source])
+            raise
+
+        self._written(sources)
+        # unacknowledged writes do not report any counts
+        if result.acknowledged:
+            counts['matched'] = result.matched_count
+            counts['modified'] = result.modified_count
+        return counts
+
+    def _written(self, sources):
+        for source in sources:
+            for key, _ in source:
+                self.retries.pop(key, None)
+
+    async def close(self):
+        """Waits for running writes and writes the remaining operators,
+        including the ones of failed writes.
+        Call this before the application stops.
+        """
+        if len(self.tasks) != 0:
+            # the failures were logged and their operators buffered again
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        try:
+            if len(self.pending) != 0:
+                await self.flush()
+        finally:
+            self._cancel_timer()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+def _append(ops, operator):
+    # operators that can not be combined are applied in order
+    merged = ops[-1].merge(operator) if ops else None
+    if merged is None:
+        ops.append(operator)
+    else:
+        ops[-1] = merged
@@ -1,4 +1,9 @@
-from . import connection, queryset, errors
+from . import connection, queryset, errors, loader, updateset, utils
+import asyncio
+import bson
+import pymongo
+from pymongo import errors as pymongo_errors
+from pymongo.write_concern import WriteConcern
 
 
 def Collection(cls):
@@ -8,42 +13,624 @@ def Collection(cls):
         return c.database[cls.__name__]
 
     @classmethod
-    async def get_objects(cls, **kwargs):
+    def _get_write_collection(cls, write_concern=None):
+        # the collection with the write concern of the call or the class
+        if write_concern is None:
+            write_concern = cls._options['write_concern']
+
+        coll = cls._get_collection()
+        if write_concern is None:
+            return coll
+        if isinstance(write_concern, dict):
+            write_concern = WriteConcern(**write_concern)
+        if not isinstance(write_concern, WriteConcern):
+            raise errors.TypeMismatch(WriteConcern, type(write_concern))
+        return coll.with_options(write_concern=write_concern)
+
+    @classmethod
+    def _build_query(cls, filters):
+        for name in filters:
+            if name != 'id' and not hasattr(cls, name):
+                raise errors.FieldNotFound(name, cls.__name__)
+
+        builder = queryset.QueryBuilder(**filters)
+        return builder.construct()
+
+    @classmethod
+    def _build_projection(cls, only, exclude):
+        if only is None and exclude is None:
+            return None, None
+        if only is not None and exclude is not None:
+            raise ValueError('Use either `only` or `exclude`, not both.')
+
+        names = only if only is not None else exclude
+        for name in names:
+            if name not in cls._schema:
+                raise errors.FieldNotFound(name, cls.__name__)
+
+        if only is not None:
+            loaded = [name for name in only if name != 'id']
+            projection = {name: 1 for name in loaded}
+            if cls._options['versioned']:
+                projection['_version'] = 1
+            return projection, loaded
+
+        loaded = [name for name in cls._schema if name not in exclude]
+        projection = {name: 0 for name in exclude if name != 'id'}
+        return projection, loaded
+
+    @classmethod
+    def _build_sort(cls, sort):
+        if sort is None:
+            return None
+        if not isinstance(sort, list):
+            sort = [sort]
+
+        result = []
+        for key in sort:
+            if not isinstance(key, tuple):
+                key = (key, pymongo.ASCENDING)
+            name, direction = key
+            if name == 'id':
+                name = '_id'
+            elif name.split('.')[0] not in cls._schema:
+                raise errors.FieldNotFound(name, cls.__name__)
+            result.append((name, direction))
+
+        return result
+
+    @classmethod
+    async def _find(
+            cls, query, batch_size=None, only=None, exclude=None,
+            sort=None, limit=0, skip=0):
+        coll = cls._get_collection()
+        projection, loaded = cls._build_projection(only, exclude)
+
+        cursor = coll.find(
+            query, projection=projection, sort=cls._build_sort(sort),
+            limit=limit, skip=skip)
+        if batch_size is not None:
+            cursor = cursor.batch_size(batch_size)
+
+        try:
+            async for data in cursor:
+                yield cls.from_son(data, loaded=loaded)
+        finally:
+            await cursor.close()
+
+    @classmethod
+    async def _get_by_ids(cls, oids, chunk_size):
+        chunks = [
+            oids[i:i + chunk_size] for i in range(0, len(oids), chunk_size)
+        ]
+        results = await asyncio.gather(*[
+            cls.get_objects(id=queryset.In(chunk)) for chunk in chunks
+        ])
+        return [doc for docs in results for doc in docs]
+
+    @classmethod
+    def iter_objects(
+            cls, batch_size=None, only=None, exclude=None,
+            sort=None, limit=0, skip=0, **kwargs):
+        """Queries the collection for multiple objects like
+        :func:`~motorturbine.document.BaseDocument.get_objects` but yields
+        each document as soon as its batch arrives instead of loading all
+        of them first. Only one batch is held in memory at a time.
+
+        >>> async for doc in Document.iter_objects(num=Gt(5), batch_size=100):
+        ...     print(doc.num)
+
+        The server cursor is closed once the iteration ends. If you stop
+        iterating early make sure to close the generator, e.g. by calling
+        its ``aclose`` method, to release the cursor immediately.
+
+        :param int batch_size: optional *(None)* –
+            The amount of documents that are fetched per round trip.
+            Uses the server default if not set.
+        :param list only: optional *(None)* –
+            Only load the given fields, see
+            :func:`~motorturbine.document.BaseDocument.get_objects`.
+        :param list exclude: optional *(None)* –
+            Load all fields except the given ones.
+        :param sort: optional *(None)* –
+            The sort order, see
+            :func:`~motorturbine.document.BaseDocument.get_objects`.
+        :param int limit: optional *(0)* –
+            The maximum amount of documents. 0 means no limit.
+        :param int skip: optional *(0)* –
+            The amount of documents to skip.
+        """  # noqa
+        query = cls._build_query(kwargs)
+        return cls._find(
+            query, batch_size=batch_size, only=only, exclude=exclude,
+            sort=sort, limit=limit, skip=skip)
+
+    @classmethod
+    async def get_objects(cls, select_related=None, **kwargs):
         """Queries the collection for multiple objects
         as defined by the supplied filters. For querying
         Motorturbine supplies its own functionality in form
         of :class:`~motorturbine.queryset.QueryOperator`.
+
+        Using ``only`` or ``exclude`` loads the documents partially.
+        Accessing a field that was not loaded raises
+        :class:`~motorturbine.errors.FieldNotLoaded` until it is loaded
+        with :func:`~motorturbine.document.BaseDocument.load`.
+        Saving a partial document never touches the fields that were
+        not loaded.
+
+        >>> docs = await Document.get_objects(only=['name'])
+        >>> docs = await Document.get_objects(exclude=['payload'])
+
+        The results can be sorted and limited. A sort key is either a field
+        name for ascending order or a tuple of the name and a pymongo
+        direction. For deep pages prefer
+        :func:`~motorturbine.document.BaseDocument.get_page` over ``skip``.
+
+        >>> docs = await Document.get_objects(
+        ...     sort=[('num', pymongo.DESCENDING), 'name'], skip=10, limit=10)
+
+        :param list only: optional *(None)* –
+            The names of the fields that should be loaded.
+        :param list exclude: optional *(None)* –
+            The names of the fields that should not be loaded.
+        :param sort: optional *(None)* –
+            A sort key or a list of sort keys.
+        :param int limit: optional *(0)* –
+            The maximum amount of documents. 0 means no limit.
+        :param int skip: optional *(0)* –
+            The amount of documents to skip.
+        :param list select_related: optional *(None)* –
+            The names of ReferenceFields whose references are loaded
+            together with the documents, see
+            :func:`~motorturbine.document.BaseDocument.prefetch_references`.
         """
-        for name in kwargs:
-            if name != 'id' and not hasattr(cls, name):
-                raise errors.FieldNotFound(name, cls.__name__)
+        objects = [doc async for doc in cls.iter_objects(**kwargs)]
+        if select_related is not None:
+            await cls.prefetch_references(objects, *select_related)
+        return objects
 
-        coll = cls._get_collection()
-        builder = queryset.QueryBuilder(**kwargs)
-        query = builder.construct()
+    @classmethod
+    async def get_page(
+            cls, sort, after=None, size=20, only=None, exclude=None,
+            select_related=None, **kwargs):
+        """Returns a page of documents using keyset pagination. The
+        documents are ordered by the ``sort`` field and by their id.
+        Instead of skipping over all previous documents the next page starts
+        right after the last document of the previous page which keeps every
+        page equally fast if the sort field is indexed together with the id.
 
-        doc_data = coll.find(query)
-        result = []
-        async for data in doc_data:
-            new_doc = cls(**data)
-            result.append(new_doc)
+        >>> page = await Document.get_page('created', size=50)
+        >>> last = page[-1]
+        >>> page = await Document.get_page(
+        ...     'created', after=(last.created, last.id), size=50)
 
-        return result
+        :param sort:
+            The field name to sort by or a tuple of the name and a pymongo
+            direction.
+        :param tuple after: optional *(None)* –
+            The sort value and the id of the last document of the previous
+            page. Returns the first page if not set.
+        :param int size: optional *(20)* –
+            The amount of documents per page.
+        :param list select_related: optional *(None)* –
+            The names of ReferenceFields whose references are loaded
+            together with the documents.
+        """
+        if not isinstance(sort, tuple):
+            sort = (sort, pymongo.ASCENDING)
+        name, direction = sort
+
+        query = cls._build_query(kwargs)
+        if after is not None:
+            value, oid = after
+            query.update(queryset.after(name, value, oid, direction))
+
+        objects = cls._find(
+            query, only=only, exclude=exclude,
+            sort=[sort, ('id', direction)], limit=size)
+        objects = [doc async for doc in objects]
+        if select_related is not None:
+            await cls.prefetch_references(objects, *select_related)
+        return objects
 
     @classmethod
-    async def get_object(cls, **kwargs):
-        """A find_one wrapper for :func:`~motorturbine.document.BaseDocument.get_objects`. Queries the collection for a single document.
+    async def get_object(cls, only=None, exclude=None, **kwargs):
+        """Queries the collection for a single document.
         Will return None if there is no or more than one document.
-        """  # noqa
+        At most two documents are fetched to check this and only the
+        returned one is loaded.
+        Accepts the same filters and projections as
+        :func:`~motorturbine.document.BaseDocument.get_objects`.
 
-        objects = await cls.get_objects(**kwargs)
+        Lookups that only filter by an id are collected across all
+        coroutines of the event loop and loaded together with a single
+        query, which is configured by the ``batch_window`` option of
+        :class:`~motorturbine.document.DocumentMeta`.
+
+        >>> docs = await asyncio.gather(
+        ...     Document.get_object(id=oid1), Document.get_object(id=oid2))
+        """
+        oid = kwargs.get('id', None)
+        batched = (
+            len(kwargs) == 1 and isinstance(oid, bson.ObjectId) and
+            only is None and exclude is None and
+            cls._options['batch_window'] is not None)
+        if batched:
+            data = await loader.get_loader(cls).load(oid)
+            if data is None:
+                return None
+            return cls.from_son(data)
+
+        coll = cls._get_collection()
+        query = cls._build_query(kwargs)
+        projection, loaded = cls._build_projection(only, exclude)
 
-        if len(objects) == 1:
-            return objects[0]
+        cursor = coll.find(query, projection=projection, limit=2)
+        found = await cursor.to_list(length=2)
+
+        if len(found) == 1:
+            return cls.from_son(found[0], loaded=loaded)
 
         return None
 
+    @classmethod
+    async def first(cls, sort=None, only=None, exclude=None, **kwargs):
+        """Queries the collection for any single document that matches the
+        filters. Unlike :func:`~motorturbine.document.BaseDocument.get_object`
+        it does not matter how many documents match.
+        Returns None if there is no matching document.
+
+        >>> doc = await Document.first(num=Gt(5), sort='num')
+
+        :param sort: optional *(None)* –
+            The sort order that decides which document is returned, see
+            :func:`~motorturbine.document.BaseDocument.get_objects`.
+        """
+        coll = cls._get_collection()
+        query = cls._build_query(kwargs)
+        projection, loaded = cls._build_projection(only, exclude)
+
+        data = await coll.find_one(
+            query, projection=projection, sort=cls._build_sort(sort))
+
+        if data is None:
+            return None
+
+        return cls.from_son(data, loaded=loaded)
+
+    @classmethod
+    async def count(cls, **kwargs):
+        """Counts the documents that match the filters on the server
+        without loading them.
+
+        >>> await Document.count(num=Gt(5))
+        3
+        """
+        coll = cls._get_collection()
+        return await coll.count_documents(cls._build_query(kwargs))
+
+    @classmethod
+    async def exists(cls, **kwargs):
+        """Checks if there is any document that matches the filters.
+        Only the id of a single document is fetched.
+
+        >>> await Document.exists(num=5)
+        True
+        """
+        coll = cls._get_collection()
+        query = cls._build_query(kwargs)
+        data = await coll.find_one(query, projection={'_id': 1})
+        return data is not None
+
+    @classmethod
+    async def distinct(cls, field_name, **kwargs):
+        """Returns the distinct values of a field of all documents that
+        match the filters. The values are returned as they are stored in
+        the database, no documents are loaded.
+
+        >>> await Document.distinct('num', num=Lt(5))
+        [1, 3, 4]
+
+        :param str field_name: The name of the field. Subfields can be
+            selected by using a dotted path.
+        """
+        if field_name == 'id':
+            field_name = '_id'
+        elif field_name.split('.')[0] not in cls._schema:
+            raise errors.FieldNotFound(field_name, cls.__name__)
+
+        coll = cls._get_collection()
+        return await coll.distinct(field_name, cls._build_query(kwargs))
+
+    @classmethod
+    async def insert_many(cls, docs, ordered=False, batch_size=1000):
+        """Inserts many new documents with as few round trips as possible.
+        The ids are assigned to the documents and every inserted document
+        is synchronised afterwards, just like after
+        :func:`~motorturbine.document.BaseDocument.save`.
+
+        Documents that can not be inserted, e.g. because of a duplicate
+        key, are reported instead of stopping the whole insert. They keep
+        their values and no id so they can be fixed and saved again.
+
+        Returns a dict with the ``inserted`` documents and the ``failed``
+        documents as tuples of the document and the error reported by
+        the database.
+
+        >>> result = await Document.insert_many(docs)
+        >>> result['failed']
+        [(<Document num=5>, {'index': 3, 'code': 11000, 'errmsg': ...})]
+
+        :param list docs: The new documents
+        :param bool ordered: optional *(False)* –
+            Insert the documents in order and stop at the first failure.
+            The documents after it are neither inserted nor reported as
+            failed.
+        :param int batch_size: optional *(1000)* –
+            The maximum amount of documents per round trip.
+
+        The documents are written with the ``write_concern`` and
+        ``bypass_document_validation`` options of the class.
+
+        :raises TypeMismatch: If a document is not an instance of exactly
+            this class, subclasses are stored in their own collection
+        :raises ValueError: If a document was already inserted
+        """
+        for doc in docs:
+            if type(doc) is not cls:
+                raise errors.TypeMismatch(cls, type(doc))
+            if doc.id is not None:
+                raise ValueError('{!r} was already inserted.'.format(doc))
+
+        coll = cls._get_write_collection()
+        bypass = cls._options['bypass_document_validation']
+        result = {'inserted': [], 'failed': []}
+        for start in range(0, len(docs), batch_size):
+            batch = docs[start:start + batch_size]
+            payloads = []
+            for doc in batch:
+                payload = doc.to_json()
+                payload.pop('id', None)
+                payload['_id'] = bson.ObjectId()
+                if cls._options['versioned']:
+                    payload['_version'] = 1
+                payloads.append(payload)
+
+            failures = {}
+            try:
+                await coll.insert_many(
+                    payloads, ordered=ordered,
+                    bypass_document_validation=bypass)
+            except pymongo_errors.BulkWriteError as e:
+                for error in e.details['writeErrors']:
+                    failures[error['index']] = error
+
+            # ordered inserts stop at the first failure
+            stop = len(batch)
+            if ordered and len(failures) != 0:
+                stop = min(failures) + 1
+
+            for index in range(stop):
+                doc = batch[index]
+                if index in failures:
+                    result['failed'].append((doc, failures[index]))
+                    continue
+
+                doc.id = payloads[index]['_id']
+                doc._synced()
+                if cls._options['versioned']:
+                    object.__setattr__(doc, '_version', 1)
+                result['inserted'].append(doc)
+
+            if stop != len(batch):
+                break
+
+        return result
+
+    @classmethod
+    def _equality_values(cls, filters):
+        # the stored values that an upsert copies from the filter
+        doc = cls.__new__(cls)
+        values = {}
+        for name, value in filters.items():
+            if isinstance(value, queryset.Eq):
+                value = value.value
+            elif isinstance(value, queryset.QueryOperator):
+                continue
+            field = cls._schema.get(name, None)
+            if field is None:
+                raise errors.FieldNotFound(name, cls.__name__)
+            value = field.to_son(field.convert(value, doc, name))
+            values['_id' if name == 'id' else name] = value
+        return values
+
+    @classmethod
+    def _to_son_values(cls, values):
+        # converts field values to their stored representation
+        doc = cls.__new__(cls)
+        result = {}
+        for name, value in values.items():
+            field = cls._schema.get(name, None)
+            if field is None or name == 'id':
+                raise errors.FieldNotFound(name, cls.__name__)
+            result[name] = field.to_son(field.convert(value, doc, name))
+        return result
+
+    @classmethod
+    def _insert_defaults(cls, skip):
+        # the declared defaults of all fields that are not given otherwise
+        doc = cls.__new__(cls)
+        return {
+            name: field.to_son(field.convert(field.default, doc, name))
+            for name, field in cls._schema.items()
+            if name != 'id' and name not in skip
+        }
+
+    @classmethod
+    async def upsert(cls, filters, **changes):
+        """Applies changes to the document that matches the filters or
+        creates it if there is none, with a single round trip.
+        Returns the document as it is stored after the update.
+
+        The changes are values or update operators. A new document
+        contains the equality values of the filters, the changes and the
+        defaults of all other fields. Operators start from the empty
+        value of a new document, e.g. 0 for an
+        :class:`~motorturbine.updateset.Inc`.
+
+        >>> stats = await Stats.upsert({'day': today}, views=Inc(1))
+
+        :param dict filters: The filters that find the document, see
+            :func:`~motorturbine.document.BaseDocument.get_objects`.
+        :param changes: The new values of the fields
+
+        :raises FieldNotFound: On a non-existent field
+        :raises TypeMismatch: If a value or operator does not fit its field
+        """
+        values = {}
+        update = {}
+        for name, value in changes.items():
+            if isinstance(value, updateset.Set):
+                value = value.update
+            if not isinstance(value, updateset.UpdateOperator):
+                values[name] = value
+                continue
+
+            if name not in cls._schema or name == 'id':
+                raise errors.FieldNotFound(name, cls.__name__)
+            if isinstance(value, (updateset.Unset, updateset.DeleteIndices)):
+                raise errors.TypeMismatch(
+                    updateset.UpdateOperator, type(value))
+            utils.validate_operator(cls._schema[name], value)
+            op, op_value = value()
+            update.setdefault(op, {})[name] = op_value
+
+        values = cls._to_son_values(values)
+        if len(values) != 0:
+            update['$set'] = values
+
+        equality = cls._equality_values(filters)
+        defaults = cls._insert_defaults(set(equality) | set(changes))
+        if len(defaults) != 0:
+            update['$setOnInsert'] = defaults
+        if cls._options['versioned']:
+            update.setdefault('$inc', {})['_version'] = 1
+
+        # the filter matches the stored form of the equality values
+        query = cls._build_query(filters)
+        query.update(equality)
+
+        coll = cls._get_write_collection()
+        data = await coll.find_one_and_update(
+            query, update, upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER,
+            **utils.bypass_validation(
+                cls._options['bypass_document_validation']))
+        return cls.from_son(data)
+
+    @classmethod
+    async def get_or_create(cls, defaults=None, **filters):
+        """Returns the document that matches the filters or creates it
+        if there is none, with a single round trip. Returns a tuple of
+        the document and whether it was created.
+
+        A new document contains the equality values of the filters,
+        the given defaults and the declared defaults of all other fields.
+
+        >>> user, created = await User.get_or_create(
+        ...     email='a@b.c', defaults={'name': 'A'})
+
+        :param dict defaults: optional *(None)* –
+            The values of a new document that are not part of the filters.
+
+        :raises FieldNotFound: On a non-existent field
+        :raises TypeMismatch: If a filter value or a default does not fit
+            its field
+        """
+        if defaults is None:
+            defaults = {}
+
+        equality = cls._equality_values(filters)
+        values = cls._to_son_values(defaults)
+        values.update(cls._insert_defaults(set(equality) | set(values)))
+
+        # the id is chosen here to build the new document without
+        # fetching it once it was inserted
+        oid = equality.get('_id', None)
+        if oid is None:
+            oid = bson.ObjectId()
+            values['_id'] = oid
+        if cls._options['versioned']:
+            values['_version'] = 1
+
+        query = cls._build_query(filters)
+        query.update(equality)
+
+        coll = cls._get_write_collection()
+        data = await coll.find_one_and_update(
+            query, {'$setOnInsert': values},
+            upsert=True, return_document=pymongo.ReturnDocument.BEFORE,
+            **utils.bypass_validation(
+                cls._options['bypass_document_validation']))
+        if data is not None:
+            return cls.from_son(data), False
+
+        return cls.from_son({**equality, **values}), True
+
+    @classmethod
+    async def ensure_indexes(cls):
+        """Creates the indexes that are declared on the document using
+        :class:`~motorturbine.indexes.Index` and ``unique`` fields.
+        Indexes that already exist are left untouched.
+
+        Returns a dict with the names of the indexes that were ``created``
+        and the names of those that were already ``existing``.
+
+        >>> await Session.ensure_indexes()
+        {'created': ['user_1'], 'existing': ['by_created']}
+        """
+        coll = cls._get_collection()
+        models = [index.to_model() for index in cls._indexes]
+        result = {'created': [], 'existing': []}
+        if len(models) == 0:
+            return result
+
+        present = await coll.index_information()
+        missing = []
+        for model in models:
+            name = model.document['name']
+            if name in present:
+                result['existing'].append(name)
+            else:
+                result['created'].append(name)
+                missing.append(model)
+
+        if len(missing) != 0:
+            await coll.create_indexes(missing)
+
+        return result
+
     setattr(cls, '_get_collection', _get_collection)
+    setattr(cls, '_get_write_collection', _get_write_collection)
+    setattr(cls, 'ensure_indexes', ensure_indexes)
+    setattr(cls, '_build_query', _build_query)
+    setattr(cls, '_build_projection', _build_projection)
+    setattr(cls, '_build_sort', _build_sort)
+    setattr(cls, '_find', _find)
+    setattr(cls, '_get_by_ids', _get_by_ids)
+    setattr(cls, 'iter_objects', iter_objects)
     setattr(cls, 'get_objects', get_objects)
+    setattr(cls, 'get_page', get_page)
     setattr(cls, 'get_object', get_object)
+    setattr(cls, 'first', first)
+    setattr(cls, 'count', count)
+    setattr(cls, 'exists', exists)
+    setattr(cls, 'distinct', distinct)
+    setattr(cls, 'insert_many', insert_many)
+    setattr(cls, '_equality_values', _equality_values)
+    setattr(cls, '_to_son_values', _to_son_values)
+    setattr(cls, '_insert_defaults', _insert_defaults)
+    setattr(cls, 'upsert', upsert)
+    setattr(cls, 'get_or_create', get_or_create)
     return cls
@@ -1,11 +1,198 @@
-from . import errors, collection, fields, updateset, utils
+from . import errors, collection, fields, indexes, unit, updateset, utils
+import asyncio
 import types
-import copy
-from pymongo import errors as pymongo_errors, UpdateOne
+import collections
+import weakref
+from pymongo import errors as pymongo_errors, ReturnDocument, UpdateOne
+
+
+class FieldDescriptor(object):
+    """Data descriptor that is generated for each field of a document class.
+    Accessing a field on a document instance returns its value while
+    accessing it on the class returns the field itself.
+    """
+    def __init__(self, field):
+        super().__init__()
+        self.field = field
+        self.name = field.name
+
+    def __get__(self, doc, owner):
+        if doc is None:
+            return self.field
+
+        try:
+            return doc._values[self.name]
+        except KeyError:
+            # only documents that were loaded with a projection miss values
+            raise errors.FieldNotLoaded(self.name, doc)
+
+    def __set__(self, doc, value):
+        if self.name not in doc._values:
+            doc._set_missing(self.name, value)
+            return
+
+        self.field.set_value(doc, self.name, value)
+
+
+class DocumentMeta(type):
+    """The metaclass of :class:`BaseDocument`. Collects the declared fields
+    of a document class once on creation and stores them as an ordered,
+    read-only schema. Instances are then created from this schema instead
+    of inspecting the class on every instantiation.
+
+    Every document class is kept in a registry by its collection name which
+    is used by :func:`~motorturbine.indexes.ensure_indexes`.
+
+    Document options are passed as keyword arguments of the class statement
+    and are inherited by subclasses::
+
+        class StrictDocument(BaseDocument, strict=True):
+            num = IntField()
+
+    Available options:
+        * strict - Validate documents that are loaded from the database.
+        * batch_window - Concurrent lookups by id are collected for this
+          amount of seconds and loaded with a single query, see
+          :func:`~motorturbine.document.BaseDocument.get_object`.
+          0 collects them until the next iteration of the event loop,
+          None disables the batching.
+        * pipeline_updates - Use pipeline updates where they need fewer
+          operations, e.g. to delete list entries. Requires MongoDB 4.2.
+        * versioned - Store a ``_version`` counter with each document and
+          save changes on the condition that it did not change instead of
+          conditions on every changed field, see
+          :func:`~motorturbine.document.BaseDocument.save`.
+        * write_concern - The write concern of all writes as a dict, e.g.
+          ``{'w': 'majority'}``, or a pymongo ``WriteConcern``. None uses
+          the write concern of the collection.
+        * ordered - Send the updates of a save as an ordered bulk write.
+        * bypass_document_validation - Skip the validation rules of the
+          collection when inserting and updating documents.
+
+    Fields may be named like the query helpers ``first``, ``count``,
+    ``exists``, ``distinct``, ``get_page``, ``insert_many``, ``upsert``,
+    ``get_or_create``, ``load`` and ``missing_fields``. The field then
+    hides the helper on its document class.
+
+    :raises FieldExpected: If a class attribute is not a field
+    :raises FieldNameReserved: If a field is named like another attribute
+        of :class:`BaseDocument`, e.g. ``save``
+    """
+    non_fields = (types.FunctionType, classmethod, staticmethod, property)
+    # helpers that are never used by the document itself, a field of the
+    # same name hides them on its class
+    query_helpers = frozenset((
+        'first', 'count', 'exists', 'distinct', 'get_page', 'insert_many',
+        'upsert', 'get_or_create', 'load', 'missing_fields'))
+    registry = weakref.WeakValueDictionary()
+    default_options = {
+        'strict': False,
+        'batch_window': 0,
+        'pipeline_updates': False,
+        'versioned': False,
+        'write_concern': None,
+        'ordered': True,
+        'bypass_document_validation': False
+    }
+
+    def __new__(mcs, name, bases, namespace, **options):
+        # documents only store their values, see BaseDocument.__slots__
+        namespace.setdefault('__slots__', ())
+        cls = super().__new__(mcs, name, bases, namespace)
+
+        for option in options:
+            if option not in mcs.default_options:
+                raise TypeError('Unknown document option {!r}'.format(option))
+        doc_options = dict(getattr(cls, '_options', mcs.default_options))
+        doc_options.update(options)
+        cls._options = types.MappingProxyType(doc_options)
+
+        schema = collections.OrderedDict()
+        base_schemas = [
+            base.__dict__['_schema'] for base in reversed(cls.__mro__[1:])
+            if '_schema' in base.__dict__]
+
+        if len(base_schemas) == 0:
+            # create general id field on the root document
+            schema['id'] = fields.ObjectIdField(sync_enabled=False, name='id')
+            cls.id = FieldDescriptor(schema['id'])
+            cls._schema = types.MappingProxyType(schema)
+            cls._indexes = ()
+            return cls
+
+        for base_schema in base_schemas:
+            schema.update(base_schema)
+
+        normals = dir(BaseDocument)
+        for attr, field in namespace.items():
+            if attr == 'id':
+                raise Exception('The `id` field is reserved and will be set automatically.')  # noqa
+            if isinstance(field, fields.BaseField):
+                # the field would silently replace or be replaced by
+                # the attribute of the same name
+                if attr in normals and attr not in mcs.query_helpers:
+                    raise errors.FieldNameReserved(attr, name)
+            elif attr.startswith('__') and attr.endswith('__'):
+                continue
+            elif attr in normals or isinstance(field, mcs.non_fields):
+                continue
+            elif isinstance(field, indexes.Index):
+                field.name = attr
+                continue
+            else:
+                raise errors.FieldExpected(field)
+
+            field.name = attr
+            schema[attr] = field
+
+        doc_indexes = [
+            indexes.Index(name, unique=True)
+            for name, field in schema.items() if field.unique
+        ]
+        declared = collections.OrderedDict()
+        for base in reversed(cls.__mro__):
+            for attr, value in base.__dict__.items():
+                if isinstance(value, indexes.Index):
+                    declared[attr] = value
+        doc_indexes.extend(declared.values())
+
+        for attr, field in schema.items():
+            setattr(cls, attr, FieldDescriptor(field))
+
+        cls._schema = types.MappingProxyType(schema)
+        cls._indexes = tuple(doc_indexes)
+        mcs.registry[name] = cls
+        return cls
+
+    def __init__(cls, name, bases, namespace, **options):
+        super().__init__(name, bases, namespace)
+
+
+async def _first_found(lookups):
+    # runs the lookups concurrently and returns the first result that is
+    # not None, the remaining lookups are cancelled
+    tasks = [asyncio.ensure_future(lookup) for lookup in lookups]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            if result is not None:
+                return result
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _increment_version(update):
+    if isinstance(update, list):
+        # pipeline updates can only set the incremented value
+        return update + [{'$set': {'_version': {
+            '$add': [{'$ifNull': ['$_version', 0]}, 1]}}}]
+    return utils.deep_merge(update, {'$inc': {'_version': 1}})
 
 
 @collection.Collection
-class BaseDocument(object):
+class BaseDocument(fields.FieldContainer, metaclass=DocumentMeta):
     """The BaseDocument is used to create new Documents
     which can be used to model your data structures.
 
@@ -29,102 +216,231 @@ class BaseDocument(object):
     :raises FieldNotFound: On access of a non-existent field
     """
 
+    __slots__ = (
+        '_values', '_updates', '_sync_fields', '_parent', '_key',
+        '_references', '_version')
+
     def __new__(cls, **kwargs):
-        normals = dir(BaseDocument)
         doc = super(BaseDocument, cls).__new__(cls)
-        object.__setattr__(doc, '_fields', {})
-        doc_fields = object.__getattribute__(doc, '_fields')
+        object.__setattr__(doc, '_values', {})
+        object.__setattr__(doc, '_updates', {})
 
         # add attribute for syncs
         object.__setattr__(doc, '_sync_fields', [])
+        object.__setattr__(doc, '_parent', None)
+        object.__setattr__(doc, '_key', None)
 
-        # create general id field
-        id_field = fields.ObjectIdField(
-            sync_enabled=False, document=doc, name='id')
-
-        doc_fields['id'] = id_field
-        coll = cls._get_collection()
-
-        for name, field in cls.__dict__.items():
-            if name not in normals and not isinstance(field, types.MethodType):
-                if not isinstance(field, fields.BaseField):
-                    raise errors.FieldExpected(field)
-                if name == 'id':
-                    raise Exception('The `id` field is reserved and will be set automatically.')  # noqa
-
-                field = copy.deepcopy(field)
-                field.document = doc
-                field.name = name
+        # references resolved by prefetch_references, created on demand
+        object.__setattr__(doc, '_references', None)
 
-                doc_fields[name] = field
-
-                if field.unique:
-                    coll.create_index(field.name, unique=True)
+        # the stored version of versioned documents
+        object.__setattr__(doc, '_version', None)
         return doc
 
     def __init__(self, **kwargs):
         super().__init__()
 
         kwargs['id'] = kwargs.pop('_id', None)
-        for name, field in self._get_fields().items():
-            field.set_value(kwargs.pop(name, field.default))
-            field.synced()
+        for name, field in self._schema.items():
+            field.set_value(self, name, kwargs.pop(name, field.default))
+        self._synced()
         if len(kwargs) != 0:
             key = next(iter(kwargs))
             raise errors.FieldNotFound(key, self)
 
+    @classmethod
+    def from_son(cls, data, strict=None, loaded=None):
+        """Creates a document from data that was loaded from the database.
+        The stored values are taken as they are and become the synchronised
+        state of the document without creating any updates.
+        Missing fields are set to their defaults.
+
+        This is used by all methods that load documents, e.g.
+        :func:`~motorturbine.document.BaseDocument.get_objects`.
+
+        :param dict data: The document as returned by the database
+        :param bool strict: optional *(None)* –
+            Validate the stored values like when creating a new document.
+            Defaults to the ``strict`` option of the document.
+        :param list loaded: optional *(None)* –
+            The names of the fields that the data contains if it was loaded
+            with a projection. All other fields are left unloaded.
+
+        :raises TypeMismatch: In strict mode, if a value has the wrong type
+        :raises FieldNotFound: In strict mode, if the data contains
+            an unknown field
+        """
+        if strict is None:
+            strict = cls._options['strict']
+
+        doc = cls.__new__(cls)
+        values = doc._values
+        values['id'] = data.get('_id', None)
+        if cls._options['versioned']:
+            object.__setattr__(doc, '_version', data.get('_version', None))
+
+        for name, field in cls._schema.items():
+            if name == 'id':
+                continue
+            if loaded is not None and name not in loaded:
+                continue
+
+            value = data.get(name, field.default)
+            if strict:
+                values[name] = field.convert(value, doc, name)
+            else:
+                values[name] = field.from_son(value, doc, name)
+
+        if strict:
+            for name in data:
+                if name in ('_id', '_version', '_unit'):
+                    continue
+                if name not in cls._schema:
+                    raise errors.FieldNotFound(name, doc)
+
+        return doc
+
     def _get_field(self, name):
-        return self._get_fields().get(name, None)
+        return self._schema.get(name, None)
+
+    def _set_missing(self, name, value):
+        # a field that was not loaded can only be replaced entirely and
+        # without a condition on its unknown current value
+        is_operator = isinstance(value, updateset.UpdateOperator)
+        if is_operator and not isinstance(value, updateset.Set):
+            raise errors.FieldNotLoaded(name, self)
+
+        self._values[name] = None
+        self._schema[name].set_value(self, name, value)
+        for update in self._updates[name]:
+            update.pop('old_value', None)
+
+    def missing_fields(self):
+        """Returns the names of the fields that were not loaded
+        because of the projection used when querying the document.
+        """
+        return [name for name in self._schema if name not in self._values]
+
+    async def load(self, *field_names):
+        """Loads fields that were excluded by the projection used when
+        querying the document. Fields that were set in the meantime
+        are not overwritten.
+
+        >>> doc = await Document.get_object(id=oid, only=['name'])
+        >>> doc.payload
+        FieldNotLoaded: Field 'payload' was not loaded on object ...
+        >>> await doc.load('payload')
+        >>> doc.payload
+        [1, 2, 3]
+
+        :param field_names: optional –
+            The fields to load. Loads all missing fields if none are given.
+        :raises FieldNotFound: On a non-existent field
+        """
+        # missing_fields may be hidden by a field of the same name
+        missing = [name for name in self._schema if name not in self._values]
+        for name in field_names:
+            if name not in self._schema:
+                raise errors.FieldNotFound(name, self)
+
+        if len(field_names) != 0:
+            missing = [name for name in field_names if name in missing]
+        if len(missing) == 0:
+            return
+
+        coll = self.__class__._get_collection()
+        projection = {name: 1 for name in missing}
+        data = await coll.find_one({'_id': self.id}, projection=projection)
+        if data is None:
+            data = {}
 
-    def _get_fields(self):
-        return object.__getattribute__(self, '_fields')
+        for name in missing:
+            if name in self._values:
+                continue
+            field = self._schema[name]
+            value = data.get(name, field.default)
+            self._values[name] = field.from_son(value, self, name)
 
     def _get_sync_fields(self):
-        return object.__getattribute__(self, '_sync_fields')
+        return self._sync_fields
 
-    def __setattr__(self, attr, value):
-        field = self._get_fields().get(attr, None)
+    def _get_child(self, key):
+        return self._values.get(key, None)
 
-        if field is None:
+    def _child_field(self, key):
+        return self._schema[key]
+
+    def _set_child(self, key, value):
+        self._values[key] = value
+
+    def _children(self):
+        return iter(self._values.values())
+
+    def _synced(self):
+        super()._synced()
+        self._sync_fields.clear()
+
+    def __setattr__(self, attr, value):
+        if attr not in self._schema:
             raise errors.FieldNotFound(attr, self)
 
-        field.set_value(value)
+        object.__setattr__(self, attr, value)
+
+    def __getattr__(self, attr):
+        # only reached if attr is neither a field nor a regular attribute
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if '.' in attr:
+            return self.get_path(attr)
+
+        raise errors.FieldNotFound(attr, self)
 
     def update_sync(self, name):
         sync_fields = self._get_sync_fields()
         if name not in sync_fields:
             sync_fields.append(name)
 
-    def __getattribute__(self, attr):
-        # mimic hasattr
-        try:
-            val = object.__getattribute__(self, attr)
-
-            is_method = isinstance(val, types.MethodType)
-            is_function = isinstance(val, types.FunctionType)
-            if attr in dir(object) or is_method or is_function:
-                return val
-        except AttributeError:
-            pass
+        active = unit.current_unit()
+        if active is not None:
+            active.add(self)
 
-        fields = self._get_fields()
+    def get_path(self, path):
+        """Returns the value of a nested field by its dotted path.
+        Plain field access like ``doc.name`` should be preferred as
+        resolving a path is considerably slower.
 
-        sub_path, cutoff = utils.get_sub_path(attr, 1)
-        field = fields.get(cutoff[0], None)
+        >>> doc.get_path('mapping.key')
+        5
+        >>> doc.get_path('lst.0.num')
+        10
 
-        if field is None:
-            raise errors.FieldNotFound(attr, self)
-
-        if sub_path == '':
-            return field.value
+        :param str path: The dotted path of the field
+        :raises FieldNotFound: If the path does not exist
+        """
+        value = self
+        for key in path.split('.'):
+            try:
+                if isinstance(value, BaseDocument):
+                    value = getattr(value, key)
+                elif isinstance(value, list):
+                    value = value[int(key)]
+                else:
+                    value = value[key]
+            except (KeyError, IndexError, ValueError, TypeError):
+                raise errors.FieldNotFound(path, self)
 
-        return getattr(field, sub_path)
+        return value
 
     async def get_reference(self, field_name, collections=None):
         """When using :class:`~motorturbine.fields.ReferenceField` this method allows
         loading the reference by the fields name.
         Returns `None` if the given field exists but is not a :class:`~motorturbine.fields.ReferenceField` type.
 
+        References that were loaded by
+        :func:`~motorturbine.document.BaseDocument.prefetch_references`
+        are returned without querying the database as long as the
+        field still refers to the same id.
+
         :param str field_name: The name of the ReferenceField
         :param list collections: optional (*None*) –
             A list of :class:`~motorturbine.document.BaseDocument` classes.
@@ -135,8 +451,7 @@ class BaseDocument(object):
 
         :raises FieldNotFound: On access of a non-existent field
         """  # noqa
-        doc_fields = self._get_fields()
-        field = doc_fields.get(field_name, None)
+        field = self._get_field(field_name)
 
         if field is None:
             raise errors.FieldNotFound(field_name, self)
@@ -146,25 +461,114 @@ class BaseDocument(object):
 
         oid = getattr(self, field_name)
 
+        if self._references is not None and field_name in self._references:
+            cached_oid, ref = self._references[field_name]
+            if cached_oid == oid:
+                return ref
+
+        if collections is not None and not isinstance(collections, list):
+            raise errors.TypeMismatch(list, collections.__class__)
+
+        location = field.get_location(oid)
+        if location is not None and location in (collections or []):
+            # try the collection that the reference was found in before
+            ref = await location.get_object(id=oid)
+            if ref is not None:
+                return ref
+
         reference_doc = field.reference_doc
         ref = await reference_doc.get_object(id=oid)
 
         if ref is None and collections is not None:
-            if not isinstance(collections, list):
-                raise errors.TypeMismatch(list, collections.__class__)
-            for coll in collections:
-                ref = await coll.get_object(id=oid)
-                if ref is not None:
-                    break
+            ref = await _first_found([
+                coll.get_object(id=oid) for coll in collections
+            ])
+
+        if ref is not None:
+            field.set_location(oid, ref.__class__)
 
         return ref
 
+    @classmethod
+    async def prefetch_references(
+            cls, docs, *field_names, collections=None, chunk_size=1000):
+        """Loads the references of many documents at once to avoid a query
+        per document when calling
+        :func:`~motorturbine.document.BaseDocument.get_reference`.
+        The ids of all documents are collected per field and loaded with
+        as few ``$in`` queries as possible. Afterwards ``get_reference``
+        returns the loaded references from memory.
+
+        >>> orders = await Order.get_objects(status='open')
+        >>> await Order.prefetch_references(orders, 'customer')
+        >>> customer = await orders[0].get_reference('customer')
+
+        :param list docs: The documents whose references should be loaded
+        :param field_names: The names of the ReferenceFields
+        :param list collections: optional (*None*) –
+            Additional document classes that are searched for references
+            that were not found, see
+            :func:`~motorturbine.document.BaseDocument.get_reference`.
+        :param int chunk_size: optional (*1000*) –
+            The maximum amount of ids per query.
+
+        :raises FieldNotFound: On a non-existent field
+        :raises TypeMismatch: If a field is not a ReferenceField
+        """
+        for name in field_names:
+            field = cls._schema.get(name, None)
+            if field is None:
+                raise errors.FieldNotFound(name, cls.__name__)
+            if not isinstance(field, fields.ReferenceField):
+                raise errors.TypeMismatch(fields.ReferenceField, type(field))
+        if collections is not None and not isinstance(collections, list):
+            raise errors.TypeMismatch(list, collections.__class__)
+
+        for name in field_names:
+            oids = []
+            seen = set()
+            for doc in docs:
+                oid = getattr(doc, name)
+                if oid is not None and oid not in seen:
+                    seen.add(oid)
+                    oids.append(oid)
+
+            field = cls._schema[name]
+            refs = await field.reference_doc._get_by_ids(oids, chunk_size)
+            found = {ref.id: ref for ref in refs}
+
+            missing = [oid for oid in oids if oid not in found]
+            if len(missing) != 0 and collections is not None:
+                results = await asyncio.gather(*[
+                    coll._get_by_ids(missing, chunk_size)
+                    for coll in collections
+                ])
+                for refs in results:
+                    for ref in refs:
+                        found.setdefault(ref.id, ref)
+                        field.set_location(ref.id, ref.__class__)
+
+            for doc in docs:
+                if doc._references is None:
+                    object.__setattr__(doc, '_references', {})
+                oid = getattr(doc, name)
+                doc._references[name] = (oid, found.get(oid, None))
+
     def to_json(self):
         """Returns the entire document as a json dictionary."""
-        doc_fields = self._get_fields()
-        return {name: field.get_value() for name, field in doc_fields.items()}
+        values = self._values
+        json = {
+            name: field.to_son(values[name])
+            for name, field in self._schema.items() if name in values
+        }
+        if self._parent is not None:
+            # embedded documents are stored without an id
+            json.pop('id')
+        return json
 
-    async def save(self, limit=0):
+    async def save(
+            self, limit=0, atomic=False, write_concern=None, ordered=None,
+            bypass_document_validation=None):
         """Calling the save method will start a synchronisation process with
         the database. Every change that was made since the last
         synchronisation is considered specifically to only update based on the
@@ -180,107 +584,479 @@ class BaseDocument(object):
             The maximum amount of tries before a save operation fails.
             Can be used as a way to catch problematic state or to probe if the
             current document has changed yet if set to 1.
+        :param bool atomic: optional *(False)* –
+            Save fields that were only changed by commutative operators,
+            e.g. :class:`~motorturbine.updateset.Inc` or
+            :class:`~motorturbine.updateset.Push`, without any condition
+            using ``find_one_and_update``. These fields never have to be
+            retried and are updated to their stored values afterwards.
+            All other fields are saved as usual.
+
+            >>> counter.hits = Inc(1)
+            >>> await counter.save(atomic=True)
+
+        Documents with the ``versioned`` option are saved with a single
+        update on the condition that their ``_version`` did not change
+        since they were loaded, which increments it. On a conflict the
+        document is reloaded, fields without pending changes take their
+        stored values and the pending changes are applied again on top
+        of them.
+
+        Changes of overlapping paths, e.g. a list that is appended to
+        after one of its entries was deleted, and pipeline updates can
+        not be combined and are sent as further updates with one ordered
+        bulk write. They all use the condition of the loaded version and
+        only the last one increments it. A concurrent save can therefore
+        be applied in between them, the remaining updates are then
+        applied on top of it like on a conflict.
+
+        The following parameters override the document options of the
+        same name for a single call:
+
+        :param write_concern: optional *(None)* –
+            The write concern as a dict or a pymongo ``WriteConcern``.
+            Unacknowledged writes, i.e. ``{'w': 0}``, can not detect
+            conflicts and are never retried.
+
+            >>> await event.save(write_concern={'w': 0})
+            >>> await invoice.save(write_concern={'w': 'majority'})
+        :param bool ordered: optional *(None)* –
+            Send the updates as an ordered bulk write. Unordered writes
+            can be faster but conflicting updates of the same field may
+            then need more tries.
+        :param bool bypass_document_validation: optional *(None)* –
+            Skip the validation rules of the collection.
 
         :raises RetryLimitReached: Raised if limit is reached
+        :raises ValueError: If unacknowledged writes are used with
+            ``atomic`` or the ``versioned`` option
         """
-        coll = self.__class__._get_collection()
-        doc_fields = self._get_fields()
+        options = self._options
+        if ordered is None:
+            ordered = options['ordered']
+        if bypass_document_validation is None:
+            bypass_document_validation = options[
+                'bypass_document_validation']
+
+        coll = self.__class__._get_write_collection(write_concern)
+        acknowledged = coll.write_concern.acknowledged
         sync_fields = self._get_sync_fields()
         if self.id is None:
-            insert_fields = {
-                name: doc_fields[name].get_value()
-                for name in doc_fields if name != 'id'
-            }
+            insert_fields = self.to_json()
+            insert_fields.pop('id', None)
+            if self._options['versioned']:
+                insert_fields['_version'] = 1
 
-            doc = await coll.insert_one({**insert_fields})
+            doc = await coll.insert_one(
+                insert_fields,
+                bypass_document_validation=bypass_document_validation)
             self.id = doc.inserted_id
-            for field in doc_fields.values():
-                sync_fields.clear()
-                field.synced()
+            self._synced()
+            if self._options['versioned']:
+                object.__setattr__(self, '_version', 1)
         else:
             if len(sync_fields) == 0:
                 return
+            # both need the returned document
+            needs_result = atomic or options['versioned']
+            if needs_result and not acknowledged:
+                raise ValueError(
+                    'Unacknowledged writes can not be used to save {!r} '
+                    'atomically or versioned.'.format(self))
+            if atomic:
+                await self._save_atomic(coll, bypass_document_validation)
+                if len(sync_fields) == 0:
+                    return
+            if self._options['versioned']:
+                await self._save_versioned(
+                    coll, limit, bypass_document_validation)
+                return
+
             tries = 0
             while True:
-                bulk_updates = []
-
-                for path in sync_fields:
-                    sub_path, cutoff = utils.get_sub_path(path, 1)
-                    name = cutoff[0]
-                    ops = doc_fields[name].get_updates(sub_path)
-
-                    assert isinstance(ops, list)
-                    if len(ops) == 0:
-                        continue
-
-                    zippable = True
-                    updates = []
-                    for val in ops:
-                        op, new_value = val['op']()
-
-                        update_name = val.get('force_name', path)
-                        if update_name != path:
-                            zippable = False
-                        update = {
-                            'filter': {},
-                            'update': {op: {update_name: new_value}}
-                        }
-                        if 'old_value' in val:
-                            update['filter'] = {path: val['old_value']}
-
-                        updates.append(update)
-                    if zippable:
-                        bulk_updates = list(zip(*bulk_updates, updates))
-                    else:
-                        bulk_updates.extend([[up] for up in updates])
-
-                update_queries = []
-                for bulk in bulk_updates:
-                    bulk_filter = {'_id': self.id}
-                    bulk_update = {}
-                    for item in bulk:
-                        bulk_filter = {**bulk_filter, **item['filter']}
-                        bulk_update = utils.deep_merge(
-                            bulk_update, item['update'])
-
-                    single_update = UpdateOne(bulk_filter, bulk_update)
-                    update_queries.append(single_update)
+                update_queries = self._build_updates()
+                if len(update_queries) == 0:
+                    self._saved()
+                    break
+
                 try:
-                    result = await coll.bulk_write(update_queries)
-                    mongo_result = result.bulk_api_result
+                    result = await coll.bulk_write(
+                        update_queries, ordered=ordered,
+                        bypass_document_validation=bypass_document_validation)
                 except pymongo_errors.BulkWriteError as e:
                     print(e.details)
                     raise e
 
+                # unacknowledged writes do not report the matched count
+                if not acknowledged:
+                    self._saved()
+                    break
                 if result.matched_count == len(update_queries):
-                    sync_fields.clear()
-
-                    for field in doc_fields.values():
-                        field.synced()
+                    self._saved()
                     break
 
                 tries += 1
                 if limit != 0 and tries >= limit:
                     raise errors.RetryLimitReached(limit, self)
 
-                projection = {'_id': 0}
+                # only the changed values are needed to refresh the guards
+                projection = utils.projection(self._dirty_paths())
+                if len(projection) == 0:
+                    projection = {'_id': 1}
                 changed_doc = await coll.find_one(
                     {'_id': self.id}, projection=projection)
+                self._refresh_guards(changed_doc)
+
+    async def _save_versioned(
+            self, coll, limit, bypass_document_validation=False):
+        # sends all updates with one ordered bulk write on the condition
+        # that the version did not change, the last one increments it
+        names = set(path.split('.')[0] for path in self._dirty_paths())
+        tries = 0
+        while True:
+            queries = self._build_versioned_queries()
+            if len(queries) == 0:
+                break
+
+            update_queries = [
+                UpdateOne(query_filter, update)
+                for query_filter, update, records in queries
+            ]
+            try:
+                result = await coll.bulk_write(
+                    update_queries,
+                    bypass_document_validation=bypass_document_validation)
+            except pymongo_errors.BulkWriteError as e:
+                # the updates before the failed one were applied
+                self._applied(queries[:e.details.get('nMatched', 0)])
+                raise
+
+            # all updates use the same version, so once one did not
+            # match the following ones do not match either
+            applied = result.matched_count
+            self._applied(queries[:applied])
+            if applied == len(queries):
+                object.__setattr__(self, '_version', (self._version or 0) + 1)
+                break
+
+            tries += 1
+            if limit != 0 and tries >= limit:
+                raise errors.RetryLimitReached(limit, self)
+            await self._reload(coll)
+
+        self._saved()
+        if tries == 0 or len(names) == 0:
+            return
+
+        # the changes were applied on top of reloaded values
+        data = await coll.find_one(
+            {'_id': self.id}, projection={name: 1 for name in names})
+        if data is not None:
+            for name in names:
+                self._refresh_path(name, data)
+
+    def _applied(self, queries):
+        # removes the pending updates that were done by the queries
+        for query_filter, update, records in queries:
+            for path, record in records:
+                pending = self._get_updates(path)
+                pending[:] = [x for x in pending if x is not record]
+
+    async def _reload(self, coll):
+        # takes the stored values of all fields without pending changes
+        # and refreshes the pending changes against the stored document
+        dirty = set(path.split('.')[0] for path in self._dirty_paths())
+        projection = {name: 1 for name in self._values if name != 'id'}
+        projection['_version'] = 1
+        data = await coll.find_one({'_id': self.id}, projection=projection)
+        if data is None:
+            return
+
+        object.__setattr__(self, '_version', data.get('_version', None))
+        for name in self._values:
+            if name != 'id' and name not in dirty:
+                self._refresh_path(name, data)
+        self._refresh_guards(data, applied=False)
+
+    async def _save_atomic(self, coll, bypass_document_validation=False):
+        # saves the fields that only use commutative operators without
+        # conditions and refreshes them from the returned document
+        sync_fields = self._get_sync_fields()
+        targets = collections.OrderedDict()
+        guarded = []
+        for path in sync_fields:
+            ops = self._get_updates(path)
+            targets[path] = [val.get('force_name', path) for val in ops]
+            if not all(val['op'].commutative for val in ops):
+                guarded.extend(targets[path] or [path])
+
+        atomic = [
+            path for path, names in targets.items()
+            if not any(
+                utils.paths_overlap(name, other)
+                for name in names or [path] for other in guarded)
+        ]
+        if len(atomic) == 0:
+            return
+
+        queries = self._build_queries(atomic, guarded=False)
+        versioned = self._options['versioned']
+        if versioned and len(queries) != 0:
+            # like a versioned save, the version is incremented once
+            query_filter, update, records = queries[-1]
+            queries[-1] = (query_filter, _increment_version(update), records)
+
+        data = None
+        if len(queries) != 0:
+            if len(queries) > 1:
+                await coll.bulk_write([
+                    UpdateOne(query_filter, update)
+                    for query_filter, update, records in queries[:-1]
+                ], bypass_document_validation=bypass_document_validation)
+
+            names = set(
+                name.split('.')[0]
+                for path in atomic for name in targets[path])
+            projection = {name: 1 for name in names}
+            if versioned:
+                projection['_version'] = 1
+            query_filter, update, records = queries[-1]
+            data = await coll.find_one_and_update(
+                query_filter, update,
+                projection=projection,
+                return_document=ReturnDocument.AFTER,
+                **utils.bypass_validation(bypass_document_validation))
+            if data is None:
+                # the document does not exist, leave it to the retries
+                return
+
+            # the version can only be taken if nobody else wrote
+            # in between, otherwise the next save reloads the document
+            expected = (self._version or 0) + 1
+            if versioned and data.get('_version', None) == expected:
+                object.__setattr__(self, '_version', expected)
+
+        for path in atomic:
+            self._clear_updates(path)
+            sync_fields.remove(path)
+
+        if data is not None:
+            for path in atomic:
+                for name in targets[path]:
+                    self._refresh_path(name, data)
+
+    def _refresh_path(self, path, data):
+        # replaces a value by its stored value
+        parent_path, _, key = path.rpartition('.')
+        try:
+            parent = self.get_path(parent_path) if parent_path else self
+        except errors.FieldNotFound:
+            return
+        if not isinstance(parent, fields.FieldContainer):
+            return
+        if isinstance(parent, list):
+            if not key.isdigit() or int(key) >= len(parent):
+                return
+            key = int(key)
+
+        field = parent._child_field(key)
+        value = utils.item_by_path(data, path)
+        if parent is self and value is None:
+            value = data.get(key, field.default)
+        parent._set_child(key, field.from_son(value, parent, key))
+
+    def _build_updates(self):
+        return [
+            UpdateOne(query_filter, update)
+            for query_filter, update, records in self._build_queries()
+        ]
+
+    def _build_queries(self, paths=None, guarded=True):
+        # builds the guarded update queries for all pending changes.
+        # updates of independent fields are combined, updates of
+        # overlapping fields are applied in the order of the changes
+        queries = []
+        rounds = []
+        round_paths = []
+
+        if paths is None:
+            paths = self._get_sync_fields()
+        for path in paths:
+            ops = self._get_updates(path)
+
+            assert isinstance(ops, list)
+            if len(ops) == 0:
+                continue
+
+            zippable = all(val.get('force_name', path) == path for val in ops)
+            updates = self._build_items(path, guarded)
+
+            touched = set(
+                [path] + [val.get('force_name', path) for val in ops])
+            overlaps = any(
+                utils.paths_overlap(one, other)
+                for one in touched for other in round_paths)
+            if overlaps:
+                queries.extend(rounds)
+                rounds = []
+                round_paths = []
+            if not zippable:
+                queries.extend([update] for update in updates)
+                continue
+
+            for index, update in enumerate(updates):
+                if index == len(rounds):
+                    rounds.append([])
+                rounds[index].append(update)
+            round_paths.append(path)
+        queries.extend(rounds)
+
+        return [self._combine(bulk) for bulk in queries]
+
+    def _build_versioned_queries(self):
+        # combines the updates of all independent paths into one query.
+        # updates of overlapping paths and pipeline updates need further
+        # queries, which are sent after the ones they depend on
+        steps = []
+        for path in self._get_sync_fields():
+            for item in self._build_items(path, guarded=False):
+                start = 0
+                for index, step in enumerate(steps):
+                    if any(utils.paths_overlap(item['name'], other['name'])
+                           for other in step):
+                        start = index + 1
+
+                pipeline = isinstance(item['update'], list)
+                for step in steps[start:]:
+                    if not pipeline and not isinstance(
+                            step[0]['update'], list):
+                        step.append(item)
+                        break
+                else:
+                    steps.append([item])
+
+        queries = []
+        for step in steps:
+            query_filter, update, records = self._combine(step)
+            # the version alone decides if the document changed
+            query_filter = {'_id': self.id, '_version': self._version}
+            queries.append((query_filter, update, records))
+
+        if len(queries) != 0:
+            # the version is only incremented once the last update is done
+            query_filter, update, records = queries[-1]
+            queries[-1] = (query_filter, _increment_version(update), records)
+        return queries
+
+    def _build_items(self, path, guarded=True):
+        # the single updates of the pending changes of a path, each with
+        # the stored path it changes and the pending changes it completes
+        items = []
+        for val in self._get_updates(path):
+            update_name = val.get('force_name', path)
+            if isinstance(val['op'], updateset.DeleteIndices):
+                deletion = val['op'].queries(update_name)
+                for update in deletion:
+                    update['name'] = update_name
+                    update['records'] = []
+                if len(deletion) != 0:
+                    # the update is done once all its queries are
+                    deletion[-1]['records'] = [(path, val)]
+                items.extend(deletion)
+                continue
+
+            op, new_value = val['op']()
+            update = {
+                'filter': {},
+                'update': {op: {update_name: new_value}},
+                'name': update_name,
+                'records': [(path, val)]
+            }
+            if guarded and 'old_value' in val:
+                update['filter'] = {path: val['old_value']}
+
+            items.append(update)
+        return items
+
+    def _combine(self, bulk):
+        # a query consists of its filter, its update and the
+        # pending updates that are done by it
+        bulk_filter = {'_id': self.id}
+        bulk_update = {}
+        records = []
+        for item in bulk:
+            bulk_filter = {**bulk_filter, **item['filter']}
+            records.extend(item['records'])
+            if isinstance(item['update'], list):
+                # pipeline updates are never combined
+                bulk_update = item['update']
+                continue
+            bulk_update = utils.deep_merge(bulk_update, item['update'])
+
+        return bulk_filter, bulk_update, records
+
+    def _saved(self):
+        # all pending changes were written
+        sync_fields = self._get_sync_fields()
+        for path in sync_fields:
+            self._clear_updates(path)
+        self._updates.clear()
+        sync_fields.clear()
+
+    def _dirty_paths(self):
+        # the stored paths that are changed by the pending updates
+        return [
+            update.get('force_name', path)
+            for path in self._get_sync_fields()
+            for update in self._get_updates(path)
+        ]
+
+    def _refresh_guards(self, data, applied=True):
+        # uses the stored values as the new conditions of the updates
+        if data is None:
+            return
+
+        for path in self._get_sync_fields():
+            item = utils.item_by_path(data, path)
+            updates = self._get_updates(path)
+
+            # updates without a condition that are sent on their own, i.e.
+            # appends, were applied by the previous try already
+            if applied:
+                updates[:] = [
+                    x for x in updates
+                    if 'old_value' in x or 'force_name' not in x or
+                    isinstance(x['op'], updateset.DeleteIndices)
+                ]
+            for x in updates:
+                if isinstance(x['op'], updateset.DeleteIndices):
+                    stored = utils.item_by_path(data, x['force_name'])
+                    x['op'].refresh(stored)
+                elif item is not None and 'old_value' in x:
+                    x['old_value'] = item
+
+    def _is_stored(self, data):
+        # checks if the stored data matches all pending changes
+        if data is None:
+            return False
+
+        for path in self._get_sync_fields():
+            for update in self._get_updates(path):
+                check_path = update.get('force_name', path)
+                name = check_path.split('.')[0]
+                value = self._schema[name].to_son(self._values[name])
+                if check_path != name:
+                    value = utils.item_by_path({name: value}, check_path)
+                if utils.item_by_path(data, check_path) != value:
+                    return False
 
-                for name, val in changed_doc.items():
-                    for path in sync_fields:
-                        item = utils.item_by_path(changed_doc, path)
-                        if item is not None:
-                            sub_path, cutoff = utils.get_sub_path(path, 1)
-                            for x in doc_fields[name].get_updates(sub_path):
-                                x['old_value'] = item
+        return True
 
     def __repr__(self):
         field_rep = ''
-        doc_fields = self._get_fields()
-        for name, field in doc_fields.items():
-            if name == 'id' and self.id is None:
+        for name, value in self._values.items():
+            if name == 'id' and value is None:
                 continue
-            field_rep = field_rep + ' {}={}'.format(name, repr(field))
+            field_rep = field_rep + ' {}={}'.format(name, repr(value))
 
         return '<{}{}>'.format(self.__class__.__name__, field_rep)
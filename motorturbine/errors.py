@@ -21,6 +21,23 @@ class FieldExpected(BaseException):
     message = 'Expected instance of BaseField, got {!r}!'
 
 
+class FieldNameReserved(BaseException):
+    """__init__(field_name, document)
+
+    Is raised when a Document declares a field whose name is already
+    used by an attribute of :class:`~motorturbine.document.BaseDocument`.
+
+    >>> raise FieldNameReserved('save', 'Page')
+    Field 'save' of 'Page' shadows an attribute of BaseDocument!
+
+    :param str field_name:
+        Name of the field
+    :param str document:
+        The name of the document class
+    """
+    message = 'Field {!r} of {!r} shadows an attribute of BaseDocument!'
+
+
 class TypeMismatch(BaseException):
     """__init__(expected, received)
 
@@ -54,6 +71,24 @@ class FieldNotFound(BaseException):
     message = 'Field {!r} was not found on object {!r}.'
 
 
+class FieldNotLoaded(BaseException):
+    """__init__(field_name, document)
+
+    Is raised when trying to access a field that was excluded by the
+    projection that was used when loading the document.
+
+    >>> raise FieldNotLoaded('attr', doc)
+    Field 'attr' was not loaded on object \
+    <ExampleDocument id=ObjectId('$oid') name='Changed My Name'>.
+
+    :param str field_name:
+        Name of the field
+    :param BaseDocument document:
+        The document that was being accessed.
+    """
+    message = 'Field {!r} was not loaded on object {!r}.'
+
+
 class RetryLimitReached(BaseException):
     """__init__(limit, document)
 
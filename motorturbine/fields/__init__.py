@@ -1,3 +1,4 @@
+from .container import FieldContainer
 from .base_field import BaseField
 from .int_field import IntField
 from .boolean_field import BooleanField
@@ -4,15 +4,18 @@ from .. import errors, updateset
 class BaseField(object):
     """__init__(*, default=None, required=False, unique=False)
 
-    The base class for any field. Used for connecting to the parent document
-    and calling general methods for setting and validating values.
+    The base class for any field. Fields are declared once on the document
+    class and only describe the values they validate. The values themselves
+    are stored by the documents, see
+    :class:`~motorturbine.fields.FieldContainer`.
 
     :param default: optional *(None)* –
         Defines a default value based on the field type.
     :param bool required: optional *(False)* –
         Defines if the fields value can be None.
     :param bool unique: optional *(False)* –
-        Defines if the fields value has to be unique.
+        Defines if the fields value has to be unique. The unique index is
+        created by :func:`~motorturbine.indexes.ensure_indexes`.
 
     :raises TypeMismatch: Trying to set a value with the wrong type
     """
@@ -23,74 +26,108 @@ class BaseField(object):
             required=False,
             unique=False,
             sync_enabled=True,
-            document=None,
             name=None):
         super().__init__()
 
-        self.document = document
         self.name = name
 
         self.unique = unique
         self.required = required
         self.sync_enabled = sync_enabled
         self.default = None
-        self.updates = []
 
         if default is not None:
             self.default = default
 
-        # set value directly and use validate_field
-        # instead of validate to avoid required check
-        self.value = self.default
-        if self.value is not None:
-            self.validate_field(self.value)
-
-    def clone(self, *args, **kwargs):
-        attrs = [
-            'unique', 'default', 'required',
-            'document', 'name', 'sync_enabled']
-        clone_kwargs = {
-            name: kwargs.get(name, getattr(self, name))
-            for name in attrs
-        }
-        return self.__class__(*args, **clone_kwargs)
+        # use validate_field instead of validate to avoid required check
+        if self.default is not None:
+            self.validate_field(self.default)
+
+    def set_value(self, container, key, new_value):
+        """Sets the value of this field in a container and records
+        the update that is needed to synchronise it.
+        """
+        old_value = container._get_child(key)
+        original = self.to_son(old_value)
 
-    def synced(self):
-        self.updates = []
+        next_operator = updateset.to_operator(old_value, new_value)
+        next_operator.set_original_value(original)
 
-    def set_value(self, new_value):
-        old_val = self.value
-        next_operator = updateset.to_operator(self.value, new_value)
-        next_operator.set_original_value(old_val)
+        is_set = isinstance(next_operator, updateset.Set)
+        if is_set:
+            next_operator.update = self.prepare(next_operator.update)
 
         new_value = next_operator.apply()
         self.validate(new_value)
+        new_value = self.to_python(new_value, container, key)
+
+        if is_set:
+            next_operator.update = self.to_son(new_value)
 
         update = {
             'op': next_operator,
-            'old_value': old_val
+            'old_value': original
         }
-        if isinstance(next_operator, updateset.Set):
-            self.updates = [update]
+        updates = container._updates
+        if is_set:
+            # a set replaces all pending updates of the key but has to keep
+            # the condition on the stored value
+            pending = updates.get(str(key), None)
+            if pending:
+                if 'old_value' in pending[0]:
+                    update['old_value'] = pending[0]['old_value']
+                else:
+                    update.pop('old_value')
+            updates[str(key)] = [update]
         else:
-            self.updates.append(update)
-
-        self.value = new_value
+            # consecutive operators are combined into a single update
+            # that keeps the condition of the first one
+            pending = updates.setdefault(str(key), [])
+            merged = None
+            if pending:
+                merged = pending[-1]['op'].merge(next_operator)
+            if merged is None:
+                pending.append(update)
+            else:
+                merged.set_original_value(pending[-1]['op'].original_value)
+                if isinstance(merged, updateset.Set):
+                    merged.update = self.to_son(new_value)
+                pending[-1]['op'] = merged
+
+        container._set_child(key, new_value)
 
         if self.sync_enabled:
-            self.document.update_sync(self.name)
-
-    def get_updates(self, path):
-        return self.updates
-
-    def get_value(self):
-        return self.value
+            container._update_sync(key)
+
+    def convert(self, value, container, key):
+        """Prepares, validates and wraps a value without recording an
+        update for it.
+        """
+        value = self.prepare(value)
+        self.validate(value)
+        return self.to_python(value, container, key)
+
+    def from_son(self, value, container, key):
+        """Returns the representation that is stored in the container
+        for a value that was loaded from the database. The value is
+        trusted and therefore not validated.
+        """
+        return value
+
+    def prepare(self, value):
+        """Converts a value that is set by the user before validation."""
+        return value
+
+    def to_python(self, value, container, key):
+        """Returns the representation that is stored in the container."""
+        return value
+
+    def to_son(self, value):
+        """Returns the representation that is stored in the database."""
+        return value
 
     def validate(self, value):
         if value is None and not self.required:
             return True
 
         return self.validate_field(value)
-
-    def __repr__(self):
-        return repr(self.value)
@@ -0,0 +1,63 @@
+class FieldContainer(object):
+    """Base class for everything that stores field values, i.e. documents
+    and the list and dict values of :class:`~motorturbine.fields.ListField`
+    and :class:`~motorturbine.fields.MapField`.
+
+    A container only holds the values themselves and a small record of
+    pending updates per key. The fields that describe these values are
+    shared by all containers and never hold per-instance state.
+
+    Subclasses have to provide the slots ``_parent``, ``_key`` and
+    ``_updates`` as well as :meth:`_get_child`, :meth:`_set_child`,
+    :meth:`_child_field` and :meth:`_children`.
+    """
+    __slots__ = ()
+
+    def _bind(self, parent, key):
+        object.__setattr__(self, '_parent', parent)
+        object.__setattr__(self, '_key', key)
+
+    def _path(self, key):
+        if self._parent is None:
+            return str(key)
+        return '{}.{}'.format(self._parent._path(self._key), key)
+
+    def _own_path(self):
+        if self._parent is None:
+            return ''
+        return self._parent._path(self._key)
+
+    def _root(self):
+        container = self
+        while container._parent is not None:
+            container = container._parent
+        return container
+
+    def _update_sync(self, key):
+        self._root().update_sync(self._path(key))
+
+    def _get_updates(self, path):
+        key, _, sub_path = path.partition('.')
+        if sub_path == '':
+            return self._updates.get(key, [])
+
+        child = self._get_child(key)
+        if not isinstance(child, FieldContainer):
+            return []
+        return child._get_updates(sub_path)
+
+    def _clear_updates(self, path):
+        key, _, sub_path = path.partition('.')
+        if sub_path == '':
+            self._updates.pop(key, None)
+            return
+
+        child = self._get_child(key)
+        if isinstance(child, FieldContainer):
+            child._clear_updates(sub_path)
+
+    def _synced(self):
+        self._updates.clear()
+        for child in self._children():
+            if isinstance(child, FieldContainer):
+                child._synced()
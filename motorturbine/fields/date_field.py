@@ -18,24 +18,26 @@ class DateTimeField(base_field.BaseField):
         * :class:`datetime.datetime`
     """  # noqa
 
-    def set_value(self, new_value):
+    def prepare(self, value):
+        if value is None:
+            return None
+
         # parse to timestamp
-        if isinstance(new_value, str):
-            new_value = parser.parse(new_value).timestamp()
-        elif isinstance(new_value, datetime.date):
-            new_value = parser.parse(new_value.isoformat()).timestamp()
-        elif isinstance(new_value, datetime.datetime):
-            new_value = new_value.timestamp()
-        elif isinstance(new_value, int) or isinstance(new_value, float):
+        if isinstance(value, str):
+            value = parser.parse(value).timestamp()
+        elif isinstance(value, datetime.date):
+            value = parser.parse(value.isoformat()).timestamp()
+        elif isinstance(value, datetime.datetime):
+            value = value.timestamp()
+        elif isinstance(value, int) or isinstance(value, float):
             pass
         else:
-            raise TypeError(new_value.__class__)
+            raise TypeError(value.__class__)
 
         # mongo doesnt store microseconds past 3 digits
-        dt = datetime.datetime.fromtimestamp(new_value)
+        dt = datetime.datetime.fromtimestamp(value)
         new_micro = int(dt.microsecond / 1000) * 1000
-        dt = dt.replace(microsecond=new_micro)
-        super().set_value(dt)
+        return dt.replace(microsecond=new_micro)
 
     def validate_field(self, value):
         if not isinstance(value, datetime.datetime):
@@ -1,6 +1,5 @@
-from .. import errors, document, updateset, utils
+from .. import errors, document
 from . import base_field
-import bson
 
 
 class DocumentField(base_field.BaseField):
@@ -42,53 +41,35 @@ class DocumentField(base_field.BaseField):
             raise errors.TypeMismatch(document.BaseDocument, type(embed_doc))
         self.embed_doc = embed_doc
 
-    def clone(self, *args, **kwargs):
-        new_field = super().clone(self.embed_doc, **kwargs)
-        return new_field
+    def prepare(self, value):
+        if isinstance(value, dict):
+            return self.embed_doc(**value)
+        return value
 
-    def set_value(self, new_value):
-        val = new_value
-        if isinstance(new_value, updateset.UpdateOperator):
-            val = new_value.update
-
-        document = val
-        if isinstance(val, dict):
-            document = self.embed_doc(**val)
-
-        if document._get_field('id') is not None:
-            document._get_fields().__delitem__('id')
-
-        def update_sync_wrapper(name):
-            self.document.update_sync(self.name + '.' + name)
-
-        object.__setattr__(document, 'update_sync', update_sync_wrapper)
+    def to_python(self, value, container, key):
+        if value is None:
+            return None
 
-        super().set_value(document)
+        # the embedded document is synchronised through its parent
+        value._synced()
+        value._bind(container, key)
+        return value
 
-    def __getattr__(self, attr):
-        sub_path, cutoff = utils.get_sub_path(attr, 1)
+    def from_son(self, value, container, key):
+        if value is None:
+            return None
 
-        if sub_path == '':
-            return self.__getattribute__(attr)
+        value = self.embed_doc.from_son(value, strict=False)
+        value._bind(container, key)
+        return value
 
-        return self.value[sub_path]
+    def to_son(self, value):
+        if value is None:
+            return None
+        return value.to_json()
 
     def validate_field(self, document):
         if isinstance(document, self.embed_doc):
             return
 
         raise errors.TypeMismatch(self.embed_doc, document.__class__)
-
-    def get_value(self):
-        if self.value is None:
-            return None
-        return self.value.to_json()
-
-    def get_updates(self, path):
-        if path == '' or self.value is None:
-            for update in self.updates:
-                update['op'].update = update['op'].update.to_json()
-            return self.updates
-
-        sub_path, cutoff = utils.get_sub_path(path, 1)
-        return self.value._get_field(cutoff[0]).get_updates(sub_path)
@@ -1,96 +1,122 @@
-from .. import errors, updateset, utils
-from . import base_field
+from .. import errors, updateset
+from . import base_field, container
 import uuid
 
 
-class ListWrapper(list):
+class ListWrapper(container.FieldContainer, list):
+    __slots__ = ('list_field', '_parent', '_key', '_updates')
+    push_key = '$push'
+    delete_key = '$delete_'
+
     def __init__(self, *args, list_field=None, **kwargs):
-        self.list_field = list_field
         super().__init__(*args, **kwargs)
+        self.list_field = list_field
+        self._parent = None
+        self._key = None
+        self._updates = {}
 
     def __eq__(self, other):
         return self.as_value() == other
 
-    def __contains__(self, value):
-        for field in self:
-            if field.value == value:
-                return True
-        return False
-
-    def __delitem__(self, index):
-        item = super().__getitem__(index)
-        del_str = '$$__mturbine_deleted'
-
-        update = {
-            'op': updateset.Set(del_str),
-            'old_value': item.value
-        }
-        deletion = {
-            'force_name': self.list_field.name,
-            'op': updateset.Pull(del_str),
-            'old_value': del_str
-        }
-        self.list_field.pseudo_operators[str(index)] = [update, deletion]
-
-        field_name = self.list_field.name + '.' + str(index)
-        self.list_field.document.update_sync(field_name)
-        super().__delitem__(index)
-
-    def __setitem__(self, index, value):
-        field = self.to_field(index, value)
-        old_value = super().__getitem__(index).value
+    def _get_child(self, key):
+        try:
+            return list.__getitem__(self, int(key))
+        except (IndexError, ValueError):
+            return None
 
-        self.list_field.pseudo_operators.pop(str(index), None)
-        list.__setitem__(self, index, field)
+    def _set_child(self, key, value):
+        list.__setitem__(self, key, value)
 
-    def to_field(self, index, value, sync_field=True):
-        name = '{}.{}'.format(self.list_field.name, str(index))
-        new_field = self.list_field.sub_field.clone(
-            document=self.list_field.document,
-            name=name,
-            sync_enabled=sync_field)
+    def _child_field(self, key):
+        return self.list_field.sub_field
 
-        if index < len(self):
-            field = list.__getitem__(self, index)
-            new_field.set_value(field.value)
-            new_field.synced()
+    def _children(self):
+        return iter(self)
 
-            new_field.updates = field.updates
+    def _index(self, index):
+        return range(len(self))[index]
 
-        new_field.set_value(value)
-        new_field.sync_enabled = True
+    def __delitem__(self, index):
+        index = self._index(index)
+        item = list.__getitem__(self, index)
+
+        pending = self._updates.get(self.push_key, None)
+        appended = 0 if pending is None else len(pending[0]['op'].update)
+        if index >= len(self) - appended:
+            # entries that were appended since the last save are only
+            # removed from the pending push
+            del pending[0]['op'].update[index - len(self) + appended]
+            self._updates.pop(str(index), None)
+        else:
+            deletion = self._pending_deletion()
+            deleted = deletion['op'].update
+
+            # the index of the entry before the pending deletions
+            stored_index = index
+            for deleted_index in sorted(deleted):
+                if deleted_index > stored_index:
+                    break
+                stored_index += 1
+            deleted[stored_index] = self.list_field.sub_field.to_son(item)
+
+        list.__delitem__(self, index)
+
+        # move the following values to their new index
+        for new_index in range(index, len(self)):
+            item = list.__getitem__(self, new_index)
+            if isinstance(item, container.FieldContainer):
+                item._bind(self, new_index)
+
+    def _pending_deletion(self):
+        # deletions are only combined if nothing else changed in between
+        # as later updates expect the indices after the deletion
+        sync_fields = self._root()._get_sync_fields()
+        prefix = self._path(self.delete_key)
+        if len(sync_fields) != 0 and sync_fields[-1].startswith(prefix):
+            key = sync_fields[-1].rpartition('.')[2]
+            if key in self._updates:
+                return self._updates[key][0]
+
+        key = self.delete_key + uuid.uuid4().hex
+        deletion = {
+            'force_name': self._own_path(),
+            'op': updateset.DeleteIndices(
+                {}, pipeline=self._root()._options['pipeline_updates'])
+        }
+        self._updates[key] = [deletion]
+        self._update_sync(key)
+        return deletion
 
-        return new_field
+    def __setitem__(self, index, value):
+        index = self._index(index)
+        self.list_field.sub_field.set_value(self, index, value)
 
     def append(self, value):
-        field = self.to_field(len(self), value, sync_field=False)
-
-        tmp_id = str(uuid.uuid4())
-        update = {
-            'force_name': self.list_field.name,
-            'op': updateset.Push(value)
-        }
-        self.list_field.pseudo_operators[tmp_id] = [update]
+        sub_field = self.list_field.sub_field
+        value = sub_field.convert(value, self, len(self))
+
+        # all appends until the next save are sent as a single $push
+        pending = self._updates.get(self.push_key, None)
+        if pending is None:
+            update = {
+                'force_name': self._own_path(),
+                'op': updateset.Push([], each=True)
+            }
+            self._updates[self.push_key] = [update]
+            self._update_sync(self.push_key)
+        else:
+            update = pending[0]
 
-        field_name = self.list_field.name + '.' + tmp_id
-        self.list_field.document.update_sync(field_name)
-        list.append(self, field)
+        update['op'].update.append(sub_field.to_son(value))
+        list.append(self, value)
 
     def extend(self, values):
         for value in values:
             self.append(value)
 
-    def _extend(self, values):
-        for value in values:
-            field = self.to_field(len(self), value, sync_field=False)
-            list.append(self, field)
-
-    def __getitem__(self, index):
-        item = super().__getitem__(index)
-        return item.value
-
     def as_value(self):
-        return [x.get_value() for x in self]
+        to_son = self.list_field.sub_field.to_son
+        return [to_son(x) for x in self]
 
 
 class ListField(base_field.BaseField):
@@ -107,98 +133,44 @@ class ListField(base_field.BaseField):
     def __init__(self, sub_field, **kwargs):
         kwargs['default'] = kwargs.pop('default', [])
         super().__init__(**kwargs)
-        self.pseudo_operators = {}
         self.sub_field = sub_field
-        self.value = ListWrapper(list_field=self)
-
-    def clone(self, *args, **kwargs):
-        return super().clone(self.sub_field, **kwargs)
-
-    def synced(self):
-        super().synced()
-        self.pseudo_operators = {}
-
-        if self.value is None:
-            return
 
-        for index in range(len(self.value)):
-            field = list.__getitem__(self.value, index)
-            if hasattr(field, 'synced'):
-                field.synced()
+        # values of simple fields can be loaded without converting them
+        loader = type(sub_field).from_son
+        self.plain_values = loader is base_field.BaseField.from_son
 
-    def set_value(self, new_value):
-        old_val = None
-        if self.value is not None:
-            old_val = self.value.as_value()
+    def to_python(self, value, container, key):
+        if value is None:
+            return None
 
-        next_operator = updateset.to_operator(self.value, new_value)
-        next_operator.set_original_value(old_val)
+        wrapper = ListWrapper(list_field=self)
+        wrapper._bind(container, key)
+        convert = self.sub_field.convert
+        for index, item in enumerate(value):
+            list.append(wrapper, convert(item, wrapper, index))
 
-        new_value = next_operator.apply()
-        self.validate(new_value)
+        return wrapper
 
-        update = {
-            'op': next_operator,
-            'old_value': old_val
-        }
-        if isinstance(next_operator, updateset.Set):
-            self.updates = [update]
-            self.pseudo_operators = {}
-        else:
-            self.updates.append(update)
+    def from_son(self, value, container, key):
+        if value is None:
+            return None
 
-        if new_value is None:
-            self.value = new_value
+        wrapper = ListWrapper(list_field=self)
+        wrapper._bind(container, key)
+        from_son = self.sub_field.from_son
+        if self.plain_values:
+            list.extend(wrapper, value)
         else:
-            self.value.clear()
-            self.value._extend(new_value)
-
-        if self.sync_enabled:
-            self.document.update_sync(self.name)
+            for index, item in enumerate(value):
+                list.append(wrapper, from_son(item, wrapper, index))
 
-    def get_updates(self, path):
-        if path == '':
-            # we need to make sure that if there is a set update on the map
-            # each update is actually a value representation of its field
-            # instead of the field itself (or document)
-            for update in self.updates:
-                op = update['op']
-                for index, field in enumerate(op.update):
-                    as_field = self.sub_field.clone(sync_enabled=False)
-                    as_field.set_value(field)
-                    op.update[index] = as_field.get_value()
+        return wrapper
 
-                old = update['old_value']
-                for index, field in enumerate(old):
-                    if isinstance(field, base_field.BaseField):
-                        old[index] = field.get_value()
-
-            return self.updates
-
-        sub_path, cutoff = utils.get_sub_path(path, 1)
-        index = cutoff[0]
-
-        val = self.pseudo_operators.get(index, None)
-        if val is not None:
-            return val
-
-        field = list.__getitem__(self.value, int(index))
-
-        return field.get_updates(sub_path)
-
-    def __getattr__(self, attr):
-        path_split = attr.split('.')
-        field_attr = path_split[0]
-        if len(path_split) == 1:
-            return self.__getattribute__(attr)
-
-        return self.value[int(path_split[1])]
+    def to_son(self, value):
+        if value is None:
+            return None
+        return value.as_value()
 
     def validate_field(self, value):
         if not isinstance(value, list):
             raise errors.TypeMismatch(list, type(value))
-
-    def get_value(self):
-        if self.value is None:
-            return None
-        return self.value.as_value()
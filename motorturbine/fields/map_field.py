@@ -1,83 +1,63 @@
-from .. import errors, updateset, utils, document
-from . import base_field, string_field
-import copy
+from .. import errors, updateset
+from . import base_field, container, string_field
 
 
-class DictWrapper(dict):
+class DictWrapper(container.FieldContainer, dict):
+    __slots__ = ('dict_field', '_parent', '_key', '_updates')
+
     def __init__(self, *args, dict_field=None, **kwargs):
-        self.dict_field = dict_field
         super().__init__(*args, **kwargs)
+        self.dict_field = dict_field
+        self._parent = None
+        self._key = None
+        self._updates = {}
 
     def __eq__(self, other):
         return self.as_value() == other
 
-    def update(self, values):
-        if values is None:
-            return
+    def _get_child(self, key):
+        return dict.get(self, key, None)
 
-        self.dict_field.validate(values)
-        for key, value in values.items():
-            self[key] = value
+    def _set_child(self, key, value):
+        dict.__setitem__(self, key, value)
+
+    def _child_field(self, key):
+        return self.dict_field.value_field
 
-    def _update(self, values):
+    def _children(self):
+        return iter(self.values())
+
+    def update(self, values):
         if values is None:
             return
 
         self.dict_field.validate(values)
         for key, value in values.items():
-            field = self.to_field(key, value, sync_field=False)
-            dict.__setitem__(self, key, field)
+            self[key] = value
 
     def __setitem__(self, key, value):
         self.dict_field.validate_key(key)
-
-        field = self.to_field(key, value)
-
-        self.dict_field.pseudo_operators.pop(key, None)
-        super().__setitem__(key, field)
-
-    def to_field(self, key, value, sync_field=True):
-        name = '{}.{}'.format(self.dict_field.name, key)
-        new_field = self.dict_field.value_field.clone(
-            document=self.dict_field.document,
-            name=name,
-            sync_enabled=sync_field)
-
-        old_field = self.get(key, None)
-        if old_field is not None:
-            new_field.set_value(old_field.get_value())
-            new_field.synced()
-
-            # new_field.operators = old_field.operators
-        new_field.set_value(value)
-        new_field.sync_enabled = True
-
-        return new_field
-
-    def __getitem__(self, index):
-        item = super().__getitem__(index)
-        if hasattr(item, 'value'):
-            item = item.value
-        return item
+        self.dict_field.value_field.set_value(self, key, value)
 
     def __delitem__(self, index):
-        item = super().__getitem__(index)
+        item = dict.__getitem__(self, index)
 
-        update = {
-            'op': updateset.Unset(index),
-            'old_value': item.value
-        }
-        self.dict_field.pseudo_operators[index] = [update]
+        update = {'op': updateset.Unset(index)}
+        pending = self._updates.get(index, None)
+        if not pending:
+            update['old_value'] = self.dict_field.value_field.to_son(item)
+        elif pending[0].get('old_value', None) is not None:
+            # keep the condition on the stored value
+            update['old_value'] = pending[0]['old_value']
+        # keys that were added since the last save need no condition
+        self._updates[index] = [update]
 
-        field_name = self.dict_field.name + '.' + index
-        self.dict_field.document.update_sync(field_name)
-        super().__delitem__(index)
+        self._update_sync(index)
+        dict.__delitem__(self, index)
 
     def as_value(self):
-        return {
-            name: dict.__getitem__(self, name).get_value()
-            for name in self
-        }
+        to_son = self.dict_field.value_field.to_son
+        return {name: to_son(value) for name, value in self.items()}
 
 
 class MapField(base_field.BaseField):
@@ -97,95 +77,45 @@ class MapField(base_field.BaseField):
                  value_field,
                  **kwargs):
         kwargs['default'] = kwargs.pop('default', {})
-        super().__init__(**kwargs)
-        self.pseudo_operators = {}
         self.key_field = string_field.StringField()
+        super().__init__(**kwargs)
         self.value_field = value_field
-        self.value = DictWrapper(dict_field=self)
-
-    def clone(self, *args, **kwargs):
-        new_field = super().clone(self.value_field, **kwargs)
-        new_field.value.update(self.default)
-        return new_field
-
-    def synced(self):
-        super().synced()
-        self.pseudo_operators = {}
 
-        if self.value is None:
-            return
+        # values of simple fields can be loaded without converting them
+        loader = type(value_field).from_son
+        self.plain_values = loader is base_field.BaseField.from_son
 
-        for name in self.value:
-            field = dict.__getitem__(self.value, name)
-            field.synced()
+    def to_python(self, value, container, key):
+        if value is None:
+            return None
 
-    def set_value(self, new_value):
-        old_val = None
-        if self.value is not None:
-            old_val = self.value.copy()
+        wrapper = DictWrapper(dict_field=self)
+        wrapper._bind(container, key)
+        convert = self.value_field.convert
+        for name, item in value.items():
+            dict.__setitem__(wrapper, name, convert(item, wrapper, name))
 
-        next_operator = updateset.to_operator(self.value, new_value)
-        next_operator.set_original_value(old_val)
+        return wrapper
 
-        new_value = next_operator.apply()
-        self.validate(new_value)
+    def from_son(self, value, container, key):
+        if value is None:
+            return None
 
-        update = {
-            'op': next_operator,
-            'old_value': old_val
-        }
-        if isinstance(next_operator, updateset.Set):
-            self.updates = [update]
-            self.pseudo_operators = {}
+        wrapper = DictWrapper(dict_field=self)
+        wrapper._bind(container, key)
+        from_son = self.value_field.from_son
+        if self.plain_values:
+            dict.update(wrapper, value)
         else:
-            self.updates.append(update)
+            for name, item in value.items():
+                dict.__setitem__(wrapper, name, from_son(item, wrapper, name))
 
-        if new_value is None:
-            self.value = new_value
-        else:
-            self.value.clear()
-            self.value._update(new_value)
-
-        if self.sync_enabled:
-            self.document.update_sync(self.name)
-
-    def get_updates(self, path):
-        if path == '':
-            # we need to make sure that if there is a set update on the map
-            # each update is actually a value representation of its field
-            # instead of the field itself (or document)
-            for update in self.updates:
-                op = update['op']
-                for key in op.update.keys():
-                    field = op.update[key]
-                    as_field = self.value_field.clone(sync_enabled=False)
-                    as_field.set_value(field)
-                    op.update[key] = as_field.get_value()
-
-                old = update['old_value']
-                for key in old.keys():
-                    field = old[key]
-                    if isinstance(field, base_field.BaseField):
-                        old[key] = field.get_value()
-
-            return self.updates
-
-        sub_path, cutoff = utils.get_sub_path(path, 1)
-        name = cutoff[0]
-
-        field = dict.get(self.value, name)
-
-        if field is None:
-            return self.pseudo_operators.get(name, [])
-        return field.get_updates(sub_path)
-
-    def __getattr__(self, attr):
-        path_split = attr.split('.')
-        field_name = path_split[0]
-        if len(path_split) == 1:
-            return super().__getattribute__(attr)
-
-        return self.value[path_split[1]]
+        return wrapper
+
+    def to_son(self, value):
+        if value is None:
+            return None
+        return value.as_value()
 
     def validate_field(self, value):
         if not isinstance(value, dict):
@@ -196,8 +126,3 @@ class MapField(base_field.BaseField):
 
     def validate_key(self, value):
         self.key_field.validate(value)
-
-    def get_value(self):
-        if self.value is None:
-            return None
-        return self.value.as_value()
@@ -1,6 +1,7 @@
-from .. import errors, document, updateset
+from .. import errors, document
 from . import ObjectIdField
 import bson
+import collections
 
 
 class ReferenceField(ObjectIdField):
@@ -16,6 +17,8 @@ class ReferenceField(ObjectIdField):
         Controls whether or not it should be possible to set instances of a subclass of
         the specified document as a reference.
     """  # noqa
+    location_cache_size = 1024
+
     def __init__(self, reference_doc, allow_subclass=False, **kwargs):
         super().__init__(**kwargs)
         if not issubclass(reference_doc, document.BaseDocument):
@@ -24,15 +27,38 @@ class ReferenceField(ObjectIdField):
         self.reference_doc = reference_doc
         self.allow_subclass = allow_subclass
 
-    def set_value(self, new_value):
-        document = new_value
-        if isinstance(new_value, updateset.UpdateOperator):
-            document = new_value.update
-        if document.id is None:
+        # remembers the collections of references that were found in
+        # other collections than the one of reference_doc
+        self.locations = collections.OrderedDict()
+
+    def get_location(self, oid):
+        """Returns the document class that a reference was last found in
+        if it was not the class of ``reference_doc``.
+        """
+        location = self.locations.get(oid, None)
+        if location is not None:
+            self.locations.move_to_end(oid)
+        return location
+
+    def set_location(self, oid, doc_class):
+        if doc_class is self.reference_doc:
+            self.locations.pop(oid, None)
+            return
+
+        self.locations[oid] = doc_class
+        self.locations.move_to_end(oid)
+        if len(self.locations) > self.location_cache_size:
+            self.locations.popitem(last=False)
+
+    def prepare(self, value):
+        if value is None or isinstance(value, bson.ObjectId):
+            return value
+
+        if value.id is None:
             raise errors.UnresolvableReference()
-        self.validate_document(document)
+        self.validate_document(value)
 
-        super().set_value(document.id)
+        return value.id
 
     def validate_document(self, document):
         if isinstance(document, self.reference_doc):
@@ -0,0 +1,118 @@
+from . import document, queryset
+import asyncio
+import pymongo
+
+
+class Index(object):
+    """__init__(*keys, unique=False, sparse=False, partial=None, \
+    expire_after=None)
+
+    Declares an index on a document. Indexes are added as attributes of
+    the document class, the attribute name is used as the name of the index.
+    Fields with ``unique=True`` automatically declare a unique index on
+    themselves.
+
+    Example usage::
+
+        class Session(BaseDocument):
+            user = fields.StringField(unique=True)
+            created = fields.DateTimeField()
+            score = fields.IntField()
+
+            by_created = Index(('created', pymongo.DESCENDING))
+            user_score = Index('user', 'score', sparse=True)
+            high_scores = Index('score', partial={'score': Gt(100)})
+            expiry = Index('created', expire_after=3600)
+
+    Indexes are never created while documents are used. Instead they are
+    built once by calling :func:`ensure_indexes` when starting your
+    application::
+
+        await ensure_indexes()
+
+    :param keys:
+        The field names of the index. Either a field name for an ascending
+        key or a tuple of the field name and a pymongo direction. Passing
+        more than one key creates a compound index.
+    :param bool unique: optional *(False)* –
+        Creates a unique index.
+    :param bool sparse: optional *(False)* –
+        Only indexes documents that contain the indexed fields.
+    :param dict partial: optional *(None)* –
+        Only indexes documents that match the given filters.
+        The filters are the same as used when querying documents, i.e.
+        :class:`~motorturbine.queryset.QueryOperator` can be used.
+    :param int expire_after: optional *(None)* –
+        Creates a TTL index which removes documents after the
+        given amount of seconds.
+    """
+    def __init__(
+            self, *keys,
+            unique=False,
+            sparse=False,
+            partial=None,
+            expire_after=None):
+        super().__init__()
+        if len(keys) == 0:
+            raise ValueError('An index requires at least one key.')
+
+        self.keys = []
+        for key in keys:
+            if not isinstance(key, tuple):
+                key = (key, pymongo.ASCENDING)
+            field_name, direction = key
+            if field_name == 'id':
+                field_name = '_id'
+            self.keys.append((field_name, direction))
+
+        self.name = None
+        self.unique = unique
+        self.sparse = sparse
+        self.partial = partial
+        self.expire_after = expire_after
+
+    def to_model(self):
+        """Returns the index as a :class:`pymongo.operations.IndexModel`."""
+        options = {}
+        if self.name is not None:
+            options['name'] = self.name
+        if self.unique:
+            options['unique'] = True
+        if self.sparse:
+            options['sparse'] = True
+        if self.partial is not None:
+            builder = queryset.QueryBuilder(**self.partial)
+            options['partialFilterExpression'] = builder.construct()
+        if self.expire_after is not None:
+            options['expireAfterSeconds'] = self.expire_after
+
+        return pymongo.IndexModel(self.keys, **options)
+
+
+async def ensure_indexes(*documents):
+    """Creates the declared indexes of the given document classes
+    concurrently. If no documents are given the indexes of every
+    document class that was defined are created.
+
+    Returns a dict that maps the collection names to the result of
+    :func:`~motorturbine.document.BaseDocument.ensure_indexes`.
+
+    >>> await ensure_indexes()
+    {'Session': {'created': ['user_1', 'by_created'], 'existing': []}}
+
+    :param documents: optional –
+        The :class:`~motorturbine.document.BaseDocument` classes
+        that should be indexed.
+    """
+    if len(documents) == 0:
+        documents = list(document.DocumentMeta.registry.values())
+
+    documents = [doc for doc in documents if len(doc._indexes) != 0]
+    results = await asyncio.gather(*[
+        doc.ensure_indexes() for doc in documents
+    ])
+
+    return {
+        doc._get_collection().name: result
+        for doc, result in zip(documents, results)
+    }
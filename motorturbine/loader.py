@@ -0,0 +1,91 @@
+import asyncio
+
+
+class IdLoader(object):
+    """Collects the lookups of single documents by id that are issued by
+    concurrent coroutines and loads them together with a single ``$in``
+    query per batch. The lookups are collected until the next iteration
+    of the event loop or, if the document sets the ``batch_window``
+    option, for the given amount of seconds.
+
+    Every id is only requested once per batch. All callers receive the
+    raw data so that each of them can create its own document from it.
+
+    There is one loader per document class and event loop, see
+    :func:`get_loader`.
+    """
+    max_batch = 1000
+
+    def __init__(self, document, loop):
+        super().__init__()
+        self.document = document
+        self.loop = loop
+        self.pending = {}
+        self.scheduled = False
+        # the loop only keeps weak references to running tasks
+        self.tasks = set()
+
+    async def load(self, oid):
+        """Returns the raw data of the document with the given id or None
+        if it does not exist.
+        """
+        future = self.pending.get(oid, None)
+        if future is None:
+            future = self.loop.create_future()
+            self.pending[oid] = future
+            self._schedule()
+
+        # the future is shared, one cancelled caller must not cancel the rest
+        return await asyncio.shield(future)
+
+    def _schedule(self):
+        if self.scheduled:
+            return
+        self.scheduled = True
+
+        window = self.document._options['batch_window']
+        if window == 0:
+            self.loop.call_soon(self._dispatch)
+        else:
+            self.loop.call_later(window, self._dispatch)
+
+    def _dispatch(self):
+        pending = list(self.pending.items())
+        self.pending = {}
+        self.scheduled = False
+
+        for start in range(0, len(pending), self.max_batch):
+            batch = dict(pending[start:start + self.max_batch])
+            task = asyncio.ensure_future(self._fetch(batch), loop=self.loop)
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _fetch(self, batch):
+        coll = self.document._get_collection()
+        found = {}
+        try:
+            cursor = coll.find({'_id': {'$in': list(batch)}})
+            async for data in cursor:
+                found[data['_id']] = data
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for oid, future in batch.items():
+            if not future.done():
+                future.set_result(found.get(oid, None))
+
+
+def get_loader(document):
+    """Returns the :class:`IdLoader` of a document class
+    for the current event loop.
+    """
+    loop = asyncio.get_event_loop()
+    loader = document.__dict__.get('_id_loader', None)
+    if loader is None or loader.loop is not loop:
+        loader = IdLoader(document, loop)
+        setattr(document, '_id_loader', loader)
+
+    return loader
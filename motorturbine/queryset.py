@@ -1,3 +1,6 @@
+import pymongo
+
+
 class QueryBuilder(dict):
     def __init__(self, **kwargs):
         if 'id' in kwargs:
@@ -14,6 +17,27 @@ class QueryBuilder(dict):
         return result
 
 
+def after(field_name, value, oid, direction=pymongo.ASCENDING):
+    """Returns a query for keyset pagination that matches every document
+    which comes after the given position when sorting by the field and
+    then by the id in the given direction.
+
+    >>> after('num', 5, oid)
+    {'$or': [{'num': {'$gt': 5}}, {'num': {'$eq': 5}, '_id': {'$gt': oid}}]}
+
+    :param str field_name: The name of the sort field
+    :param value: The sort value of the last document
+    :param ObjectId oid: The id of the last document
+    :param int direction: optional *(pymongo.ASCENDING)* –
+        The direction of the sort order.
+    """
+    op = Gt if direction == pymongo.ASCENDING else Lt
+    greater = QueryBuilder(**{field_name: op(value)})
+    tie = QueryBuilder(**{field_name: Eq(value), 'id': op(oid)})
+
+    return {'$or': [greater.construct(), tie.construct()]}
+
+
 class QueryOperator(object):
     """QueryOperators can be used to automatically generate
     queries that are understood by mongo. Each of the operators
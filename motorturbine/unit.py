@@ -0,0 +1,204 @@
+from . import errors, utils
+import asyncio
+import bson
+import collections
+import contextvars
+from pymongo import UpdateOne
+
+_current_unit = contextvars.ContextVar('motorturbine_unit', default=None)
+
+
+class UnitOfWork(object):
+    """Collects every saved document that is changed while the unit is
+    active and writes all of their changes at once when it is left.
+    Use :func:`unit_of_work` to create a unit.
+
+    The changes are grouped by collection and each collection is updated
+    with a single unordered bulk write. The updates use the same
+    conditions as :func:`~motorturbine.document.BaseDocument.save`, or
+    the version of documents with the ``versioned`` option. Each update
+    also stores a marker of its write in the ``_unit`` field of the
+    document. If any of them did not match, the markers of the documents
+    are fetched with a single query and only the updates that were not
+    applied are written again, with conditions on the fetched values.
+    The writes use the ``write_concern`` and ``bypass_document_validation``
+    options of the document classes.
+
+    :param int limit: optional *(0)* –
+        The maximum amount of tries per collection before the write fails,
+        see :func:`~motorturbine.document.BaseDocument.save`.
+
+    :raises RetryLimitReached: Raised if limit is reached
+    """
+    def __init__(self, limit=0):
+        super().__init__()
+        self.limit = limit
+        self.documents = collections.OrderedDict()
+        self.token = None
+
+    def add(self, doc):
+        """Adds a document to the unit. Documents that are changed while
+        the unit is active are added automatically.
+        """
+        if doc._parent is None and doc.id is not None:
+            self.documents[doc] = None
+
+    async def flush(self):
+        """Writes the changes of all collected documents."""
+        grouped = collections.OrderedDict()
+        for doc in self.documents:
+            if len(doc._get_sync_fields()) != 0:
+                grouped.setdefault(type(doc), []).append(doc)
+        self.documents.clear()
+
+        await asyncio.gather(*[
+            self._flush_collection(doc_class, docs)
+            for doc_class, docs in grouped.items()
+        ])
+
+    async def _flush_collection(self, doc_class, docs):
+        coll = doc_class._get_write_collection()
+        bypass = doc_class._options['bypass_document_validation']
+        versioned = doc_class._options['versioned']
+        names = {
+            id(doc): set(path.split('.')[0] for path in doc._dirty_paths())
+            for doc in docs
+        }
+        reloaded = collections.OrderedDict()
+        tries = 0
+        while len(docs) != 0:
+            token = bson.ObjectId()
+            update_queries = []
+            sent = []
+            for doc in docs:
+                if versioned:
+                    queries = doc._build_versioned_queries()
+                else:
+                    queries = doc._build_queries()
+                if len(queries) == 0:
+                    doc._saved()
+                    continue
+
+                for index, (query_filter, update, records) in enumerate(
+                        queries):
+                    update_queries.append(
+                        UpdateOne(query_filter, _mark(update, index, token)))
+                sent.append((doc, queries))
+            if len(sent) == 0:
+                break
+
+            # the markers tell which updates were applied, so their
+            # order does not matter
+            result = await coll.bulk_write(
+                update_queries, ordered=False,
+                bypass_document_validation=bypass)
+            if not result.acknowledged or (
+                    result.matched_count == len(update_queries)):
+                for doc, queries in sent:
+                    _saved(doc)
+                break
+
+            tries += 1
+            if self.limit != 0 and tries >= self.limit:
+                raise errors.RetryLimitReached(self.limit, sent[0][0])
+
+            paths = ['_unit']
+            if not versioned:
+                paths.extend(
+                    path for doc, queries in sent
+                    for path in doc._dirty_paths())
+            query = {'_id': {'$in': [doc.id for doc, queries in sent]}}
+            stored = {}
+            async for data in coll.find(
+                    query, projection=utils.projection(paths)):
+                stored[data.pop('_id')] = data
+
+            docs = []
+            for doc, queries in sent:
+                data = stored.get(doc.id, None)
+                markers = (data or {}).get('_unit', {})
+                applied = [
+                    query for index, query in enumerate(queries)
+                    if markers.get(str(index), None) == token
+                ]
+                if len(applied) == len(queries):
+                    _saved(doc)
+                    continue
+
+                doc._applied(applied)
+                if not versioned:
+                    doc._refresh_guards(data, applied=False)
+                docs.append(doc)
+
+            if versioned:
+                # conflicting documents are reloaded like by their save
+                await asyncio.gather(*[doc._reload(coll) for doc in docs])
+                for doc in docs:
+                    reloaded[doc.id] = doc
+
+        if len(reloaded) == 0:
+            return
+
+        # the changes were applied on top of reloaded values
+        query = {'_id': {'$in': [doc.id for doc in reloaded.values()]}}
+        projection = utils.projection([
+            name for doc in reloaded.values() for name in names[id(doc)]])
+        async for data in coll.find(query, projection=projection):
+            doc = reloaded[data['_id']]
+            for name in names[id(doc)]:
+                doc._refresh_path(name, data)
+
+    async def __aenter__(self):
+        self.token = _current_unit.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        _current_unit.reset(self.token)
+        self.token = None
+
+        # documents keep their changes if the block failed
+        if exc_type is None:
+            await self.flush()
+
+
+def _mark(update, index, token):
+    # every update stores the token of its write under its index
+    marker = {'_unit.{}'.format(index): token}
+    if isinstance(update, list):
+        return update + [{'$set': marker}]
+    return utils.deep_merge(update, {'$set': marker})
+
+
+def _saved(doc):
+    # all updates of the document were applied
+    doc._saved()
+    if doc._options['versioned']:
+        object.__setattr__(doc, '_version', (doc._version or 0) + 1)
+
+
+def unit_of_work(limit=0):
+    """Returns a :class:`UnitOfWork` to be used as an async context manager.
+    Every saved document that is changed inside of the block is written
+    when the block is left, using one bulk write per collection instead
+    of one per document.
+
+    >>> async with unit_of_work():
+    ...     for order in orders:
+    ...         order.status = 'shipped'
+    ...     customer.orders = Inc(len(orders))
+
+    New documents are not inserted by the unit, use
+    :func:`~motorturbine.document.BaseDocument.save` or
+    :func:`~motorturbine.document.BaseDocument.insert_many` for them.
+    If the block raises an exception nothing is written and the documents
+    keep their changes.
+
+    :param int limit: optional *(0)* –
+        The maximum amount of tries per collection before the write fails.
+    """
+    return UnitOfWork(limit=limit)
+
+
+def current_unit():
+    """Returns the active :class:`UnitOfWork` or None."""
+    return _current_unit.get()
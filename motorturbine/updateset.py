@@ -16,7 +16,17 @@ class UpdateOperator(object):
     update queries that are understood by mongo. Each of the operators
     can be used as defined in the mongo manual as they're just
     a direct mapping.
+
+    Operators that are ``commutative`` do not depend on the stored value
+    and can be saved without conditions, see
+    :func:`~motorturbine.document.BaseDocument.save`.
+
+    Operators that are applied to the same field one after another before
+    saving are combined into one where possible, e.g. two
+    :class:`Inc` operators are saved as a single one with their sum.
     """
+    commutative = False
+
     def __init__(self, update):
         super().__init__()
         self.update = update
@@ -24,6 +34,13 @@ class UpdateOperator(object):
     def set_original_value(self, value):
         self.original_value = value
 
+    def merge(self, other):
+        """Returns a single operator that has the same effect as applying
+        this operator and then the other one or None if they can not be
+        combined.
+        """
+        return None
+
 
 class Set(UpdateOperator):
     """Is used to set the specified field to any given value.
@@ -46,6 +63,14 @@ class Set(UpdateOperator):
     def apply(self):
         return self.update
 
+    def merge(self, other):
+        if isinstance(other, (Set, Unset, DeleteIndices)):
+            return None
+
+        # any change of a value that is set is part of the new value
+        other.set_original_value(self.update)
+        return Set(other.apply())
+
 
 class Unset(UpdateOperator):
     """Is used to remove an entry from a list or dict.
@@ -80,12 +105,21 @@ class Inc(UpdateOperator):
     >>> Inc(5)()
     {'$inc': 5}
     """
+    commutative = True
+
     def __call__(self):
         return '$inc', self.update
 
     def apply(self):
         return self.original_value + self.update
 
+    def merge(self, other):
+        if isinstance(other, Inc):
+            return Inc(self.update + other.update)
+        if isinstance(other, Dec):
+            return Inc(self.update - other.update)
+        return None
+
 
 class Dec(UpdateOperator):
     """Is used to decrease a numeric value.
@@ -99,12 +133,21 @@ class Dec(UpdateOperator):
     >>> Dec(5)()
     {'$inc': -5}
     """
+    commutative = True
+
     def __call__(self):
         return '$inc', -self.update
 
     def apply(self):
         return self.original_value - self.update
 
+    def merge(self, other):
+        if isinstance(other, Dec):
+            return Dec(self.update + other.update)
+        if isinstance(other, Inc):
+            return Inc(other.update - self.update)
+        return None
+
 
 class Max(UpdateOperator):
     """Update the field to the maximum of database and current value.
@@ -118,12 +161,19 @@ class Max(UpdateOperator):
     >>> Max(5)()
     {'$max': 5}
     """
+    commutative = True
+
     def __call__(self):
         return '$max', self.update
 
     def apply(self):
         return max(self.original_value, self.update)
 
+    def merge(self, other):
+        if isinstance(other, Max):
+            return Max(max(self.update, other.update))
+        return None
+
 
 class Min(UpdateOperator):
     """Update the field to the minimum of database and current value.
@@ -137,12 +187,19 @@ class Min(UpdateOperator):
     >>> Min(5)()
     {'$min': 5}
     """
+    commutative = True
+
     def __call__(self):
         return '$min', self.update
 
     def apply(self):
         return min(self.original_value, self.update)
 
+    def merge(self, other):
+        if isinstance(other, Min):
+            return Min(min(self.update, other.update))
+        return None
+
 
 class Mul(UpdateOperator):
     """Is used to multipy a numeric value by a given amount.
@@ -156,30 +213,95 @@ class Mul(UpdateOperator):
     >>> Mul(5)()
     {'$mul': 5}
     """
+    commutative = True
+
     def __call__(self):
         return '$mul', self.update
 
     def apply(self):
         return self.original_value * self.update
 
+    def merge(self, other):
+        if isinstance(other, Mul):
+            return Mul(self.update * other.update)
+        return None
+
 
 class Push(UpdateOperator):
-    """Is used to append a value to a list.
+    """__init__(update, *, each=False, position=None, slice=None)
+
+    Is used to append a value to a list.
 
     Example usage:
 
     >>> doc.num_list = Push(5)
+    >>> doc.num_list = Push([1, 2, 3], each=True, position=0, slice=10)
 
     Query:
 
     >>> Push(5)()
     {'$push': 5}
+    >>> Push([1, 2], each=True, slice=-5)()
+    {'$push': {'$each': [1, 2], '$slice': -5}}
+
+    Appending to a list with ``append`` or ``extend`` uses a single
+    Push with ``each`` for all values that are added before saving.
+
+    :param bool each: optional *(False)* –
+        Push every entry of the given list instead of the list itself.
+    :param int position: optional *(None)* –
+        Insert the values at this index instead of appending them.
+    :param int slice: optional *(None)* –
+        Trim the list after pushing to its first entries or, if negative,
+        to its last entries.
     """
+    commutative = True
+
+    def __init__(self, update, each=False, position=None, slice=None):
+        super().__init__(update)
+        self.each = each
+        self.position = position
+        self.slice = slice
+
+    def values(self):
+        if self.each:
+            return list(self.update)
+        return [self.update]
+
     def __call__(self):
-        return '$push', self.update
+        if not self.each and self.position is None and self.slice is None:
+            return '$push', self.update
+
+        modifiers = {'$each': self.values()}
+        if self.position is not None:
+            modifiers['$position'] = self.position
+        if self.slice is not None:
+            modifiers['$slice'] = self.slice
+        return '$push', modifiers
 
     def apply(self):
-        return self.original_value.append(self.update)
+        result = list(self.original_value)
+        if self.position is None:
+            result.extend(self.values())
+        else:
+            result[self.position:self.position] = self.values()
+
+        if self.slice is not None:
+            if self.slice < 0:
+                result = result[self.slice:]
+            else:
+                result = result[:self.slice]
+        return result
+
+    def merge(self, other):
+        # values are only appended in order if neither push moves or
+        # trims the list
+        plain = (self.position is None and self.slice is None)
+        if not isinstance(other, Push) or not plain:
+            return None
+        if other.position is not None or other.slice is not None:
+            return None
+        return Push(self.values() + other.values(), each=True)
 
 
 class Pull(UpdateOperator):
@@ -194,6 +316,8 @@ class Pull(UpdateOperator):
     >>> Pull(5)()
     {'$pull': 5}
     """
+    commutative = True
+
     def __call__(self):
         return '$pull', self.update
 
@@ -216,6 +340,8 @@ class PullAll(UpdateOperator):
     >>> PullAll([5, 6, 7])()
     {'$pullAll': [5, 6, 7]}
     """
+    commutative = True
+
     def __call__(self):
         return '$pullAll', self.update
 
@@ -224,3 +350,105 @@ class PullAll(UpdateOperator):
             val for val in self.original_value
             if val not in self.update
         ]
+
+
+class DeleteIndices(UpdateOperator):
+    """__init__(update, *, pipeline=False)
+
+    Is used to remove the entries at the given indices from a list.
+    Deleting entries with ``del`` uses a single DeleteIndices for all
+    entries that are deleted one after another before saving.
+
+    Example usage:
+
+    >>> del doc.num_list[2]
+    >>> del doc.num_list[0]
+
+    The update maps the indices to the stored values of the entries.
+    The entries are only removed if they still contain these values.
+    By default the entries are replaced by a placeholder which is then
+    pulled from the list. With ``pipeline`` a single pipeline update is
+    used instead, which requires MongoDB 4.2.
+
+    Query:
+
+    >>> DeleteIndices({0: 5, 2: 7}).queries('num_list')
+    [{'filter': {'num_list.0': 5, 'num_list.2': 7},
+      'update': {'$set': {'num_list.0': '$$__mturbine_deleted',
+                          'num_list.2': '$$__mturbine_deleted'}}},
+     {'filter': {'num_list': '$$__mturbine_deleted'},
+      'update': {'$pull': {'num_list': '$$__mturbine_deleted'}}}]
+    """
+    placeholder = '$$__mturbine_deleted'
+
+    def __init__(self, update, pipeline=False):
+        super().__init__(update)
+        self.pipeline = pipeline
+
+    def queries(self, path):
+        if len(self.update) == 0:
+            return []
+
+        indices = sorted(self.update)
+        paths = ['{}.{}'.format(path, index) for index in indices]
+        guards = {
+            item_path: self.update[index]
+            for item_path, index in zip(paths, indices)
+        }
+
+        # pipelines can not address entries of lists that are in lists
+        nested = any(part.isdigit() for part in path.split('.'))
+        if self.pipeline and not nested:
+            segments = []
+            start = 0
+            for index in indices:
+                if index > start:
+                    segments.append(
+                        {'$slice': ['$' + path, start, index - start]})
+                start = index + 1
+            segments.append({'$slice': ['$' + path, start, 2 ** 31 - 1]})
+
+            update = [{'$set': {path: {'$concatArrays': segments}}}]
+            return [{'filter': guards, 'update': update}]
+
+        return [{
+            'filter': guards,
+            'update': {
+                '$set': {item_path: self.placeholder for item_path in paths}
+            }
+        }, {
+            'filter': {path: self.placeholder},
+            'update': {'$pull': {path: self.placeholder}}
+        }]
+
+    def refresh(self, stored):
+        """Finds the entries in the stored list again after it was changed
+        in the database. Entries that are gone are not deleted anymore.
+        """
+        if not isinstance(stored, list):
+            self.update = {}
+            return
+
+        targets = {}
+        moved = []
+        for index, value in sorted(self.update.items()):
+            stored_value = stored[index] if index < len(stored) else None
+            if stored_value in (value, self.placeholder):
+                # entries that were replaced already only have to be pulled
+                targets[index] = stored_value
+            else:
+                moved.append(value)
+
+        for value in moved:
+            for index, item in enumerate(stored):
+                if index not in targets and item == value:
+                    targets[index] = value
+                    break
+
+        self.update = targets
+
+    def apply(self):
+        return [
+            val for index, val in enumerate(self.original_value)
+            if index not in self.update
+        ]
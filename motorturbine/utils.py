@@ -1,3 +1,6 @@
+from . import errors, fields, updateset
+
+
 def deep_merge(original, update):
     for key, value in original.items():
         if key not in update:
@@ -10,6 +13,41 @@ def deep_merge(original, update):
     return update
 
 
+def paths_overlap(path, other):
+    """Checks if two dotted paths are the same or one contains the other."""
+    return (
+        path == other or
+        path.startswith(other + '.') or
+        other.startswith(path + '.'))
+
+
+def stored_path(path):
+    """Returns the part of a path that can be used in a projection,
+    i.e. the path up to the first list index or internal key.
+    """
+    parts = []
+    for part in path.split('.'):
+        if part.isdigit() or part.startswith('$'):
+            break
+        parts.append(part)
+    return '.'.join(parts)
+
+
+def projection(paths):
+    """Returns a projection that includes the given paths. Paths that are
+    contained in other paths are left out.
+    """
+    included = []
+    stored = set(stored_path(path) for path in paths)
+    for path in sorted(stored, key=lambda path: path.count('.')):
+        if path == '':
+            continue
+        if not any(paths_overlap(path, other) for other in included):
+            included.append(path)
+
+    return {path: 1 for path in included}
+
+
 def item_by_path(container, path):
     split = path.split('.')
     index = split[0]
@@ -19,7 +57,7 @@ def item_by_path(container, path):
             return None
 
         index = int(index)
-        if len(container) < index:
+        if len(container) <= index:
             return None
         container = container[index]
     else:
@@ -55,3 +93,66 @@ def get_sub_path(path, start, end=None, symbol='.'):
 
     cutoff = (symbol.join(start_bit), symbol.join(end_bit))
     return symbol.join(result), cutoff
+
+
+def bypass_validation(bypass):
+    """Returns the keyword arguments of ``find_one_and_update`` that skip
+    the document validation, which it only accepts as a command option.
+    """
+    if bypass:
+        return {'bypassDocumentValidation': True}
+    return {}
+
+
+def field_by_path(document, path):
+    """Returns the declared field of a path like ``stats.views``.
+
+    :param document: The document class
+    :param str path: The name or path of the field
+    :raises FieldNotFound: On a non-existent field
+    """
+    name, *parts = path.split('.')
+    field = None if name == 'id' else document._schema.get(name, None)
+    for part in parts:
+        if isinstance(field, fields.MapField):
+            field = field.value_field
+        elif isinstance(field, fields.ListField) and part.isdigit():
+            field = field.sub_field
+        elif isinstance(field, fields.DocumentField):
+            field = field.embed_doc._schema.get(part, None)
+        else:
+            field = None
+
+    if field is None:
+        raise errors.FieldNotFound(path, document.__name__)
+    return field
+
+
+def validate_operator(field, operator):
+    """Checks if an operator fits a field before it is sent,
+    as it would only fail once it is written.
+
+    :raises TypeMismatch: If the operator does not fit the field
+    """
+    numeric = (fields.IntField, fields.FloatField)
+    if isinstance(operator, (updateset.Inc, updateset.Dec, updateset.Mul)):
+        if not isinstance(field, numeric):
+            raise errors.TypeMismatch(numeric, type(field))
+        if isinstance(field, fields.FloatField):
+            # integers can be added to floats
+            if not isinstance(operator.update, (int, float)):
+                raise errors.TypeMismatch(float, type(operator.update))
+            return
+    elif isinstance(operator, updateset.Push):
+        if not isinstance(field, fields.ListField):
+            raise errors.TypeMismatch(fields.ListField, type(field))
+        for value in operator.values():
+            field.sub_field.validate(value)
+        return
+    elif isinstance(operator, (updateset.Pull, updateset.PullAll)):
+        # pulled values may be conditions
+        if not isinstance(field, fields.ListField):
+            raise errors.TypeMismatch(fields.ListField, type(field))
+        return
+
+    field.validate(operator.update)
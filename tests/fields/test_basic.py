@@ -26,7 +26,7 @@ def test_bool_doc():
 
 def test_validate_int():
     field = fields.IntField(default=5)
-    assert field.value == 5
+    assert field.default == 5
 
     with pytest.raises(errors.TypeMismatch):
         field = fields.IntField(default='None')
@@ -41,6 +41,8 @@ async def test_datetime_unique(db_config, database):
     class DateDoc(BaseDocument):
         stamp = fields.DateTimeField(unique=True)
 
+    await DateDoc.ensure_indexes()
+
     now = datetime.datetime.utcnow()
     doc = DateDoc(stamp=now)
     await doc.save()
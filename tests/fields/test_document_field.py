@@ -189,3 +189,25 @@ async def test_set_list(db_config, database):
 
     json = [{'num': 10}, {'num': 11}]
     assert saved.to_json()['ref_lst'] == json
+
+
+@pytest.mark.asyncio
+async def test_push_after_set(db_config, database):
+    connection.Connection.connect(**db_config)
+
+    class IntDoc(BaseDocument):
+        num = fields.IntField()
+
+    class EmbedDoc(BaseDocument):
+        docs = fields.ListField(fields.DocumentField(IntDoc))
+
+    doc = EmbedDoc()
+    await doc.save()
+
+    # the push becomes part of the set value
+    doc.docs = [IntDoc(num=1)]
+    doc.docs = updateset.Push(IntDoc(num=2))
+    await doc.save()
+
+    saved = database['EmbedDoc'].find_one()
+    assert saved['docs'] == [{'num': 1}, {'num': 2}]
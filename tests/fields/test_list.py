@@ -1,6 +1,6 @@
 import pytest
 from motorturbine import BaseDocument, fields, errors, connection
-from motorturbine.updateset import Inc
+from motorturbine.updateset import Inc, Push
 
 
 @pytest.mark.asyncio
@@ -246,3 +246,111 @@ async def test_list_update_multiple(db_config, database):
     docs = coll.find_one()
 
     assert docs['nums'][0] == 15
+
+
+@pytest.mark.asyncio
+async def test_list_append_many(db_config, database):
+    connection.Connection.connect(**db_config)
+
+    class ListDoc(BaseDocument):
+        nums = fields.ListField(fields.IntField())
+
+    l = ListDoc(nums=[0])
+    await l.save()
+
+    for num in range(1, 1000):
+        l.nums.append(num)
+    l.nums.extend([1000, 1001])
+
+    assert len(l._build_updates()) == 1
+
+    await l.save()
+    coll = database['ListDoc']
+    assert coll.find_one()['nums'] == list(range(1002))
+
+    l.nums.append(5)
+    await l.save()
+    assert coll.find_one()['nums'][-2:] == [1001, 5]
+
+
+@pytest.mark.asyncio
+async def test_list_push(db_config, database):
+    connection.Connection.connect(**db_config)
+
+    class ListDoc(BaseDocument):
+        nums = fields.ListField(fields.IntField())
+
+    l = ListDoc(nums=[1, 2, 3])
+    await l.save()
+
+    l.nums = Push(0, position=0)
+    assert l.nums == [0, 1, 2, 3]
+    await l.save()
+
+    l.nums = Push([4, 5, 6], each=True, slice=-4)
+    assert l.nums == [3, 4, 5, 6]
+    await l.save()
+
+    coll = database['ListDoc']
+    assert coll.find_one()['nums'] == [3, 4, 5, 6]
+
+    l.nums = Push(7)
+    assert l.nums == [3, 4, 5, 6, 7]
+    await l.save()
+    assert coll.find_one()['nums'] == [3, 4, 5, 6, 7]
+
+
+@pytest.mark.asyncio
+async def test_list_delete_many(db_config, database):
+    connection.Connection.connect(**db_config)
+
+    class ListDoc(BaseDocument):
+        nums = fields.ListField(fields.IntField())
+
+    class PipelineListDoc(ListDoc, pipeline_updates=True):
+        pass
+
+    for doc_class, operations in [(ListDoc, 2), (PipelineListDoc, 1)]:
+        l = doc_class(nums=list(range(10)))
+        await l.save()
+
+        del l.nums[1]
+        del l.nums[3]
+        del l.nums[-1]
+        del l.nums[0]
+        assert l.nums == [2, 3, 5, 6, 7, 8]
+        assert len(l._build_updates()) == operations
+
+        await l.save()
+        coll = database[doc_class.__name__]
+        assert coll.find_one({'_id': l.id})['nums'] == [2, 3, 5, 6, 7, 8]
+
+    # appended entries are removed before they are pushed
+    l.nums.extend([10, 11, 12])
+    del l.nums[-2]
+    assert len(l._build_updates()) == 1
+    await l.save()
+    assert coll.find_one({'_id': l.id})['nums'] == [2, 3, 5, 6, 7, 8, 10, 12]
+
+
+@pytest.mark.asyncio
+async def test_list_delete_moved(db_config, database):
+    connection.Connection.connect(**db_config)
+
+    class ListDoc(BaseDocument):
+        nums = fields.ListField(fields.IntField())
+
+    l = ListDoc(nums=[1, 2, 3, 4])
+    await l.save()
+
+    other = await ListDoc.get_object(id=l.id)
+    other.nums = Push(0, position=0)
+    await other.save()
+
+    # the entries moved to other indices in the meantime
+    del l.nums[1]
+    del l.nums[2]
+    await l.save(limit=2)
+
+    coll = database['ListDoc']
+    assert coll.find_one()['nums'] == [0, 1, 3]
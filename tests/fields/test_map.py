@@ -151,3 +151,36 @@ async def test_map_defaults(db_config, database):
 
     doc = coll.find_one()
     assert doc['mapping']['x'] == 10
+
+
+@pytest.mark.asyncio
+async def test_map_many_changes(db_config, database):
+    connection.Connection.connect(**db_config)
+
+    class MapDoc(BaseDocument):
+        mapping = fields.MapField(fields.IntField())
+        nums = fields.ListField(fields.IntField())
+
+    m = MapDoc(mapping={'a': 1, 'b': 2, 'c': 3, 'd': 4})
+    await m.save()
+
+    m.mapping['a'] = 10
+    m.mapping['a'] = 11
+    del m.mapping['b']
+    m.nums.append(1)
+    m.mapping['e'] = 5
+    m.mapping['f'] = 6
+    del m.mapping['f']
+    del m.mapping['c']
+    m.mapping['c'] = 7
+
+    # all map changes are combined with a single $set and $unset
+    assert len(m._build_updates()) == 2
+
+    # the conditions still refer to the stored values
+    await m.save(limit=1)
+
+    coll = database['MapDoc']
+    stored = coll.find_one()
+    assert stored['mapping'] == {'a': 11, 'c': 7, 'd': 4, 'e': 5}
+    assert stored['nums'] == [1]
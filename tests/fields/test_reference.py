@@ -81,3 +81,121 @@ async def test_get_reference(db_config, database):
 
     assert isinstance(retrieved1, ParentDoc)
     assert isinstance(retrieved2, ChildDoc)
+
+
+@pytest.mark.asyncio
+async def test_prefetch_references(db_config, database):
+    connection.Connection.connect(**db_config)
+
+    class ParentDoc(BaseDocument):
+        num = fields.IntField()
+
+    class ChildDoc(ParentDoc):
+        num = fields.IntField()
+
+    class ReferenceDoc(BaseDocument):
+        ref = fields.ReferenceField(ParentDoc, allow_subclass=True)
+        num = fields.IntField()
+
+    parents = []
+    for num in range(5):
+        parent = ParentDoc(num=num)
+        await parent.save()
+        parents.append(parent)
+
+    child = ChildDoc(num=10)
+    await child.save()
+
+    for index in range(10):
+        await ReferenceDoc(ref=parents[index % 5], num=index).save()
+    await ReferenceDoc(ref=child, num=10).save()
+    await ReferenceDoc(ref=None, num=11).save()
+
+    docs = await ReferenceDoc.get_objects(sort='num')
+    await ReferenceDoc.prefetch_references(
+        docs, 'ref', collections=[ChildDoc], chunk_size=2)
+
+    # references are now served without querying the database
+    database['ParentDoc'].delete_many({})
+    database['ChildDoc'].delete_many({})
+
+    for index in range(10):
+        ref = await docs[index].get_reference('ref')
+        assert ref.id == parents[index % 5].id
+        assert ref.num == index % 5
+
+    ref = await docs[10].get_reference('ref')
+    assert isinstance(ref, ChildDoc)
+    assert ref.num == 10
+    assert await docs[11].get_reference('ref') is None
+
+    # a changed reference is loaded again
+    docs[0].ref = child
+    assert await docs[0].get_reference('ref') is None
+
+    with pytest.raises(errors.TypeMismatch):
+        await ReferenceDoc.prefetch_references(docs, 'num')
+    with pytest.raises(errors.FieldNotFound):
+        await ReferenceDoc.prefetch_references(docs, 'other')
+
+
+@pytest.mark.asyncio
+async def test_select_related(db_config, database):
+    connection.Connection.connect(**db_config)
+
+    class IntDoc(BaseDocument):
+        num = fields.IntField()
+
+    class ReferenceDoc(BaseDocument):
+        ref = fields.ReferenceField(IntDoc)
+
+    doc = IntDoc(num=5)
+    await doc.save()
+    await ReferenceDoc(ref=doc).save()
+
+    docs = await ReferenceDoc.get_objects(select_related=['ref'])
+    page = await ReferenceDoc.get_page('id', select_related=['ref'])
+    database['IntDoc'].delete_many({})
+
+    for found in [docs[0], page[0]]:
+        ref = await found.get_reference('ref')
+        assert ref.num == 5
+
+
+@pytest.mark.asyncio
+async def test_get_reference_fallbacks(db_config, database):
+    connection.Connection.connect(**db_config)
+
+    class ParentDoc(BaseDocument):
+        num = fields.IntField()
+
+    class ChildDoc(ParentDoc):
+        pass
+
+    class OtherChildDoc(ParentDoc):
+        pass
+
+    class ReferenceDoc(BaseDocument):
+        ref = fields.ReferenceField(ParentDoc, allow_subclass=True)
+
+    child = OtherChildDoc(num=3)
+    await child.save()
+
+    ref_doc = ReferenceDoc(ref=child)
+    await ref_doc.save()
+
+    collections = [ChildDoc, OtherChildDoc]
+    ref = await ref_doc.get_reference('ref', collections=collections)
+    assert isinstance(ref, OtherChildDoc)
+    assert ref.num == 3
+
+    field = ReferenceDoc.ref
+    assert field.get_location(child.id) is OtherChildDoc
+
+    ref = await ref_doc.get_reference('ref', collections=collections)
+    assert isinstance(ref, OtherChildDoc)
+
+    # the cached location is only a hint
+    database['OtherChildDoc'].delete_many({})
+    assert await ref_doc.get_reference('ref', collections=collections) is None
+    assert await ref_doc.get_reference('ref') is None
@@ -0,0 +1,166 @@
+import asyncio
+import pytest
+from motorturbine import BaseDocument, fields, errors, connection, WriteBuffer
+from motorturbine.updateset import Inc, Max, Set
+from pymongo import errors as pymongo_errors
+
+
+@pytest.mark.asyncio
+async def test_write_buffer(db_config, database):
+    connection.Connection.connect(**db_config)
+    coll = database['Page']
+
+    class Page(BaseDocument):
+        views = fields.IntField(default=0)
+        peak = fields.IntField(default=0)
+        stats = fields.MapField(fields.IntField())
+        name = fields.StringField()
+
+    pages = [Page(stats={'likes': 0}) for _ in range(2)]
+    for page in pages:
+        await page.save()
+
+    flushes = []
+    buffer = WriteBuffer(interval=None, on_flush=flushes.append)
+    for _ in range(500):
+        buffer.add(pages[0], 'views', Inc(1))
+        buffer.add(pages[1], 'stats.likes', Inc(2))
+    buffer.add(pages[0], 'peak', Max(3))
+    buffer.add(pages[0], 'peak', Max(2))
+    buffer.add(pages[0], 'views', Max(1000))
+    buffer.add_by_id(Page, pages[1].id, 'views', Inc(1))
+
+    with pytest.raises(errors.TypeMismatch):
+        buffer.add(pages[0], 'views', Set(1))
+    with pytest.raises(errors.FieldNotFound):
+        buffer.add(pages[0], 'missing', Inc(1))
+    with pytest.raises(errors.FieldNotFound):
+        buffer.add(pages[0], 'views.missing', Inc(1))
+
+    # operators that do not fit the field are rejected right away
+    with pytest.raises(errors.TypeMismatch):
+        buffer.add(pages[0], 'name', Inc(1))
+    with pytest.raises(errors.TypeMismatch):
+        buffer.add(pages[0], 'peak', Max('a'))
+
+    # nothing is written before the flush
+    assert coll.find_one({'_id': pages[0].id})['views'] == 0
+
+    metrics = await buffer.flush()
+    assert flushes == [metrics]
+    # empty writes are not reported
+    assert await buffer.flush() is None
+    assert flushes == [metrics]
+    assert buffer.last_flush is metrics
+    assert metrics['operators'] == 1004
+    assert metrics['fields'] == 4
+    assert metrics['documents'] == 2
+    assert metrics['updates'] == 3
+    assert metrics['matched'] == 3
+
+    first = coll.find_one({'_id': pages[0].id})
+    assert first['views'] == 1000
+    assert first['peak'] == 3
+    second = coll.find_one({'_id': pages[1].id})
+    assert second['views'] == 1
+    assert second['stats'] == {'likes': 1000}
+
+    # buffered operators are written on their own and when closing
+    buffer = WriteBuffer(interval=0.01, max_size=2)
+    buffer.add(pages[0], 'views', Inc(1))
+    await asyncio.sleep(0.05)
+    assert buffer.last_flush['fields'] == 1
+
+    async with buffer:
+        buffer.add(pages[0], 'views', Inc(1))
+        buffer.add(pages[1], 'views', Inc(1))
+        buffer.add(pages[1], 'peak', Inc(1))
+        # the size limit only starts a single write
+        assert len(buffer.tasks) == 1
+    assert coll.find_one({'_id': pages[0].id})['views'] == 1002
+    assert coll.find_one({'_id': pages[1].id})['views'] == 2
+    assert coll.find_one({'_id': pages[1].id})['peak'] == 1
+
+
+@pytest.mark.asyncio
+async def test_write_buffer_failure(db_config, database, caplog):
+    connection.Connection.connect(**db_config)
+    coll = database['Page']
+
+    class Page(BaseDocument):
+        views = fields.IntField(default=0, unique=True)
+
+    await Page.ensure_indexes()
+    pages = [Page(views=num) for num in [0, 1, 5]]
+    for page in pages:
+        await page.save()
+
+    # the first increment conflicts with the unique views of another page
+    buffer = WriteBuffer(interval=None)
+    buffer.add(pages[0], 'views', Inc(1))
+    buffer.add(pages[2], 'views', Inc(1))
+    with pytest.raises(pymongo_errors.BulkWriteError):
+        await buffer.flush()
+    assert buffer.last_flush['failed'] == 1
+
+    # only the failed update is written again
+    assert coll.find_one({'_id': pages[2].id})['views'] == 6
+    assert list(buffer.pending) == [(Page, pages[0].id, 'views')]
+
+    coll.delete_one({'_id': pages[1].id})
+    buffer.add(pages[0], 'views', Inc(2))
+    await buffer.close()
+    assert coll.find_one({'_id': pages[0].id})['views'] == 3
+    assert coll.find_one({'_id': pages[2].id})['views'] == 6
+
+    # failures of writes in the background are logged
+    blocking = Page(views=4)
+    await blocking.save()
+    buffer = WriteBuffer(interval=None, max_size=1)
+    buffer.add(pages[0], 'views', Inc(1))
+    await asyncio.sleep(0.01)
+    assert 'Writing the buffered operators failed' in caplog.text
+    assert list(buffer.pending) == [(Page, pages[0].id, 'views')]
+
+    coll.delete_one({'_id': blocking.id})
+    await buffer.close()
+    assert coll.find_one({'_id': pages[0].id})['views'] == 4
+
+    # updates that keep failing are dropped after the retries
+    buffer = WriteBuffer(interval=None, max_retries=1)
+    buffer.add(pages[0], 'views', Inc(2))
+    for _ in range(2):
+        with pytest.raises(pymongo_errors.BulkWriteError):
+            await buffer.flush()
+    assert buffer.last_flush['dropped'] == 1
+    assert len(buffer.pending) == 0
+    assert 'Dropped the buffered operators of Page.views' in caplog.text
+    assert coll.find_one({'_id': pages[0].id})['views'] == 4
+
+
+@pytest.mark.asyncio
+async def test_write_buffer_write_concern(db_config, database, monkeypatch):
+    connection.Connection.connect(**db_config)
+
+    class Page(BaseDocument, write_concern={'w': 1, 'j': False}):
+        views = fields.IntField(default=0)
+
+    page = Page()
+    await page.save()
+
+    concerns = []
+    get_collection = Page._get_write_collection.__func__
+
+    def recording_collection(cls, write_concern=None):
+        coll = get_collection(cls, write_concern)
+        concerns.append(coll.write_concern.document)
+        return coll
+
+    monkeypatch.setattr(
+        Page, '_get_write_collection', classmethod(recording_collection))
+
+    buffer = WriteBuffer(interval=None)
+    buffer.add(page, 'views', Inc(1))
+    await buffer.flush()
+    assert concerns == [{'w': 1, 'j': False}]
+    assert database['Page'].find_one()['views'] == 1
@@ -1,6 +1,11 @@
 import pytest
-from motorturbine import BaseDocument, fields, errors, connection
+import asyncio
+import datetime
+from motorturbine import BaseDocument, fields, errors, connection, loader
 from motorturbine.queryset import Eq, Ne, Lt, Lte, Gt, Gte, In, Nin
+import pymongo
+from bson import ObjectId
+from motorturbine.updateset import Inc, Push
 
 
 @pytest.mark.asyncio
@@ -39,3 +44,370 @@ async def test_query(db_config):
 
     found = await Document.get_objects(num=Nin([6, 10]))
     assert len(found) == 0
+
+
+@pytest.mark.asyncio
+async def test_iter_objects(db_config):
+    connection.Connection.connect(**db_config)
+
+    class Document(BaseDocument):
+        num = fields.IntField()
+
+    for num in range(10):
+        await Document(num=num).save()
+
+    found = [
+        doc.num async for doc in Document.iter_objects(
+            num=Gte(5), batch_size=2)
+    ]
+    assert sorted(found) == [5, 6, 7, 8, 9]
+
+    objects = Document.iter_objects(batch_size=3)
+    first = await objects.__anext__()
+    assert isinstance(first, Document)
+    await objects.aclose()
+
+    with pytest.raises(errors.FieldNotFound):
+        async for doc in Document.iter_objects(other=5):
+            pass
+
+
+@pytest.mark.asyncio
+async def test_projection(db_config, database):
+    connection.Connection.connect(**db_config)
+
+    class Document(BaseDocument):
+        num = fields.IntField()
+        name = fields.StringField()
+        payload = fields.ListField(fields.IntField())
+
+    doc = Document(num=1, name='test', payload=[1, 2, 3])
+    await doc.save()
+
+    found = await Document.get_object(id=doc.id, only=['num'])
+    assert found.num == 1
+    assert found.missing_fields() == ['name', 'payload']
+    with pytest.raises(errors.FieldNotLoaded):
+        found.payload
+
+    found.num = 5
+    found.name = 'changed'
+    await found.save()
+
+    saved = database['Document'].find_one()
+    assert saved['num'] == 5
+    assert saved['name'] == 'changed'
+    assert saved['payload'] == [1, 2, 3]
+
+    await found.load()
+    assert found.payload == [1, 2, 3]
+    assert found.missing_fields() == []
+
+    found = await Document.get_object(id=doc.id, exclude=['payload'])
+    assert found.name == 'changed'
+    assert found.missing_fields() == ['payload']
+    assert 'payload' not in found.to_json()
+
+    with pytest.raises(errors.FieldNotFound):
+        await Document.get_objects(only=['other'])
+
+
+@pytest.mark.asyncio
+async def test_sort_limit_skip(db_config):
+    connection.Connection.connect(**db_config)
+
+    class Document(BaseDocument):
+        num = fields.IntField()
+
+    for num in [3, 1, 4, 1, 5, 9, 2, 6]:
+        await Document(num=num).save()
+
+    found = await Document.get_objects(sort='num')
+    assert [doc.num for doc in found] == [1, 1, 2, 3, 4, 5, 6, 9]
+
+    found = await Document.get_objects(
+        sort=('num', pymongo.DESCENDING), skip=1, limit=3)
+    assert [doc.num for doc in found] == [6, 5, 4]
+
+    with pytest.raises(errors.FieldNotFound):
+        await Document.get_objects(sort='other')
+
+
+@pytest.mark.asyncio
+async def test_get_page(db_config):
+    connection.Connection.connect(**db_config)
+
+    class Document(BaseDocument):
+        num = fields.IntField()
+
+    for num in [3, 1, 4, 1, 5, 9, 2, 6, 5, 3]:
+        await Document(num=num).save()
+
+    for direction in [pymongo.ASCENDING, pymongo.DESCENDING]:
+        sort = ('num', direction)
+        expected = await Document.get_objects(sort=[sort, ('id', direction)])
+
+        pages = []
+        page = await Document.get_page(sort, size=3)
+        while len(page) != 0:
+            pages.append(page)
+            last = page[-1]
+            page = await Document.get_page(
+                sort, after=(last.num, last.id), size=3)
+
+        assert [len(page) for page in pages] == [3, 3, 3, 1]
+        found = [doc.id for page in pages for doc in page]
+        assert found == [doc.id for doc in expected]
+
+    page = await Document.get_page('num', size=10, num=Gt(4))
+    assert [doc.num for doc in page] == [5, 5, 6, 9]
+
+
+@pytest.mark.asyncio
+async def test_get_object_first(db_config):
+    connection.Connection.connect(**db_config)
+
+    class Document(BaseDocument):
+        num = fields.IntField()
+        payload = fields.StringField()
+
+    for num in [4, 2, 2, 7]:
+        await Document(num=num, payload='x').save()
+
+    found = await Document.get_object(num=2)
+    assert found is None
+
+    found = await Document.get_object(num=7, only=['num'])
+    assert found.num == 7
+    assert found.missing_fields() == ['payload']
+
+    found = await Document.first(num=10)
+    assert found is None
+
+    found = await Document.first(num=2)
+    assert found.num == 2
+
+    found = await Document.first(sort=('num', pymongo.DESCENDING))
+    assert found.num == 7
+
+    found = await Document.first(num=Gt(2), sort='num', exclude=['payload'])
+    assert found.num == 4
+    assert found.missing_fields() == ['payload']
+
+
+@pytest.mark.asyncio
+async def test_count_exists_distinct(db_config):
+    connection.Connection.connect(**db_config)
+
+    class Document(BaseDocument):
+        num = fields.IntField()
+        tags = fields.ListField(fields.StringField())
+
+    assert await Document.count() == 0
+    assert not await Document.exists()
+
+    await Document(num=1, tags=['a', 'b']).save()
+    await Document(num=3, tags=['b']).save()
+    await Document(num=3, tags=['c']).save()
+
+    assert await Document.count() == 3
+    assert await Document.count(num=3) == 2
+    assert await Document.count(num=Gt(5)) == 0
+
+    assert await Document.exists(num=1)
+    assert not await Document.exists(num=2)
+
+    assert sorted(await Document.distinct('num')) == [1, 3]
+    assert sorted(await Document.distinct('tags', num=3)) == ['b', 'c']
+    assert len(await Document.distinct('id', num=Lt(3))) == 1
+
+    with pytest.raises(errors.FieldNotFound):
+        await Document.distinct('other')
+
+    with pytest.raises(errors.FieldNotFound):
+        await Document.count(other=5)
+
+
+@pytest.mark.asyncio
+async def test_batched_get_object(db_config, monkeypatch):
+    connection.Connection.connect(**db_config)
+
+    class Document(BaseDocument):
+        num = fields.IntField()
+
+    class UnbatchedDocument(Document, batch_window=None):
+        pass
+
+    docs = []
+    for num in range(4):
+        doc = Document(num=num)
+        await doc.save()
+        docs.append(doc)
+
+    queries = []
+    get_collection = Document._get_collection.__func__
+
+    def counting_collection(cls):
+        coll = get_collection(cls)
+        find = coll.find
+
+        def counting_find(*args, **kwargs):
+            queries.append(args[0])
+            return find(*args, **kwargs)
+
+        coll.find = counting_find
+        return coll
+
+    monkeypatch.setattr(
+        Document, '_get_collection', classmethod(counting_collection))
+
+    oids = [docs[0].id, docs[1].id, docs[0].id, docs[3].id, ObjectId()]
+    found = await asyncio.gather(*[
+        Document.get_object(id=oid) for oid in oids
+    ])
+    assert len(queries) == 1
+    assert [doc.num for doc in found[:4]] == [0, 1, 0, 3]
+    assert found[4] is None
+    assert found[0] is not found[2]
+
+    # the loader keeps its running fetches until they are done
+    await asyncio.sleep(0)
+    assert loader.get_loader(Document).tasks == set()
+
+    queries.clear()
+    found = await asyncio.gather(
+        Document.get_object(id=docs[2].id),
+        Document.get_object(id=docs[1].id, num=1))
+    assert [doc.num for doc in found] == [2, 1]
+    assert len(queries) == 2
+
+    monkeypatch.setattr(
+        UnbatchedDocument, '_get_collection',
+        classmethod(counting_collection))
+    queries.clear()
+    await asyncio.gather(
+        UnbatchedDocument.get_object(id=docs[2].id),
+        UnbatchedDocument.get_object(id=docs[1].id))
+    assert len(queries) == 2
+
+
+@pytest.mark.asyncio
+async def test_insert_many(db_config, database):
+    connection.Connection.connect(**db_config)
+
+    class Document(BaseDocument):
+        num = fields.IntField(unique=True)
+
+    await Document.ensure_indexes()
+
+    docs = [Document(num=num) for num in [1, 2, 2, 3, 1]]
+    result = await Document.insert_many(docs, batch_size=2)
+
+    assert result['inserted'] == [docs[0], docs[1], docs[3]]
+    assert [doc for doc, error in result['failed']] == [docs[2], docs[4]]
+    assert all(error['code'] == 11000 for doc, error in result['failed'])
+    assert docs[2].id is None
+
+    for doc in result['inserted']:
+        assert doc.id is not None
+        assert doc._get_sync_fields() == []
+    assert database['Document'].count_documents({}) == 3
+
+    doc = await Document.get_object(id=docs[3].id)
+    assert doc.num == 3
+
+    docs = [Document(num=num) for num in [4, 1, 5]]
+    result = await Document.insert_many(docs, ordered=True)
+    assert result['inserted'] == [docs[0]]
+    assert [doc for doc, error in result['failed']] == [docs[1]]
+    assert docs[2].id is None
+    assert database['Document'].count_documents({}) == 4
+
+    with pytest.raises(ValueError):
+        await Document.insert_many([docs[0]])
+
+    # subclasses are stored in their own collection
+    class SubDocument(Document):
+        pass
+
+    with pytest.raises(errors.TypeMismatch):
+        await Document.insert_many([SubDocument(num=6)])
+
+
+@pytest.mark.asyncio
+async def test_upsert(db_config, database):
+    connection.Connection.connect(**db_config)
+    coll = database['Stats']
+
+    class Stats(BaseDocument):
+        day = fields.StringField()
+        views = fields.IntField(default=0)
+        label = fields.StringField(default='none')
+        tags = fields.ListField(fields.StringField())
+        since = fields.DateTimeField()
+
+    stats = await Stats.upsert({'day': 'mon'}, views=Inc(1), tags=['a'])
+    assert stats.id is not None
+    assert stats.day == 'mon'
+    assert stats.views == 1
+    assert stats.label == 'none'
+    assert stats.tags == ['a']
+
+    stats = await Stats.upsert({'day': 'mon'}, views=Inc(2), label='x')
+    assert stats.views == 3
+    assert stats.label == 'x'
+    assert stats.tags == ['a']
+    assert coll.count_documents({}) == 1
+
+    stats.views = Inc(1)
+    await stats.save()
+    assert coll.find_one()['views'] == 4
+
+    with pytest.raises(errors.FieldNotFound):
+        await Stats.upsert({'day': 'mon'}, missing=1)
+    with pytest.raises(errors.TypeMismatch):
+        await Stats.upsert({'day': 'mon'}, views=Inc('x'))
+    with pytest.raises(errors.TypeMismatch):
+        await Stats.upsert({'day': 'mon'}, tags=Push(1))
+
+    # filter values are compared in their stored form
+    first = await Stats.upsert({'since': '2020-01-01'}, views=Inc(1))
+    second = await Stats.upsert(
+        {'since': datetime.datetime(2020, 1, 1)}, views=Inc(1))
+    assert second.id == first.id
+    assert second.views == 2
+    assert second.since == datetime.datetime(2020, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_get_or_create(db_config, database):
+    connection.Connection.connect(**db_config)
+    coll = database['User']
+
+    class User(BaseDocument):
+        email = fields.StringField()
+        name = fields.StringField(default='anonymous')
+        logins = fields.IntField(default=0)
+
+    user, created = await User.get_or_create(
+        email='a@b.c', defaults={'name': 'A'})
+    assert created
+    assert user.email == 'a@b.c'
+    assert user.name == 'A'
+    assert user.logins == 0
+
+    stored = coll.find_one()
+    assert stored['_id'] == user.id
+    assert stored['name'] == 'A'
+    assert stored['logins'] == 0
+
+    same, created = await User.get_or_create(
+        email='a@b.c', defaults={'name': 'B'})
+    assert not created
+    assert same.id == user.id
+    assert same.name == 'A'
+    assert coll.count_documents({}) == 1
+
+    same.logins = Inc(1)
+    await same.save()
+    assert coll.find_one()['logins'] == 1
@@ -1,5 +1,7 @@
 import pytest
-from motorturbine import BaseDocument, fields, errors, connection
+from motorturbine import (
+    BaseDocument, fields, errors, connection, utils, WriteBuffer)
+from motorturbine.updateset import Inc
 from pymongo import errors as pymongo_errors
 import json
 
@@ -103,6 +105,8 @@ async def test_unique(db_config, database):
     class IntDoc(BaseDocument):
         num = fields.IntField(unique=True, required=True)
 
+    await IntDoc.ensure_indexes()
+
     int_doc = IntDoc(num=10)
     await int_doc.save()
 
@@ -155,3 +159,268 @@ async def test_set_id(db_config, database):
         class Doc(BaseDocument):
             id = fields.IntField()
         doc = Doc()
+
+
+def test_field_access():
+    class Inner(BaseDocument):
+        num = fields.IntField()
+
+    class Doc(BaseDocument):
+        name = fields.StringField()
+        mapping = fields.MapField(fields.IntField())
+        lst = fields.ListField(fields.DocumentField(Inner))
+
+    assert isinstance(Doc.name, fields.StringField)
+
+    doc = Doc(name='test', mapping={'key': 5}, lst=[Inner(num=10)])
+    assert doc.name == 'test'
+    assert doc.get_path('mapping.key') == 5
+    assert doc.get_path('lst.0.num') == 10
+    assert getattr(doc, 'mapping.key') == 5
+
+    with pytest.raises(errors.FieldNotFound):
+        doc.unknown
+
+    with pytest.raises(errors.FieldNotFound):
+        doc.get_path('mapping.missing')
+
+    with pytest.raises(errors.FieldNotFound):
+        doc.unknown = 5
+
+
+def test_compact_state():
+    class Doc(BaseDocument):
+        num = fields.IntField(default=5)
+        lst = fields.ListField(fields.IntField())
+
+    doc = Doc(lst=[1, 2])
+    assert not hasattr(doc, '__dict__')
+    assert doc._values == {'id': None, 'num': 5, 'lst': [1, 2]}
+    assert doc._updates == {}
+    assert Doc.num.default == 5
+
+    doc.num = 10
+    doc.lst[0] = 3
+    assert doc._sync_fields == ['num', 'lst.0']
+    assert Doc.num.default == 5
+    assert Doc(num=1).num == 1
+
+
+@pytest.mark.asyncio
+async def test_from_son(db_config, database):
+    connection.Connection.connect(**db_config)
+
+    class Inner(BaseDocument):
+        num = fields.IntField()
+
+    class Doc(BaseDocument):
+        num = fields.IntField(default=1)
+        lst = fields.ListField(fields.IntField())
+        inner = fields.MapField(fields.DocumentField(Inner))
+
+    coll = database['Doc']
+    oid = coll.insert_one({
+        'lst': [1, 2],
+        'inner': {'a': {'num': 5}}
+    }).inserted_id
+
+    doc = await Doc.get_object(id=oid)
+    assert doc.id == oid
+    assert doc.num == 1
+    assert doc.lst == [1, 2]
+    assert doc.inner['a'].num == 5
+    assert doc._sync_fields == []
+    assert doc._updates == {}
+
+    doc.lst.append(3)
+    doc.inner['a'].num = 6
+    await doc.save()
+
+    saved = coll.find_one()
+    assert saved['lst'] == [1, 2, 3]
+    assert saved['inner'] == {'a': {'num': 6}}
+
+    broken = {'_id': oid, 'num': 'text'}
+    assert Doc.from_son(broken).num == 'text'
+    with pytest.raises(errors.TypeMismatch):
+        Doc.from_son(broken, strict=True)
+
+    class StrictDoc(BaseDocument, strict=True):
+        num = fields.IntField()
+
+    with pytest.raises(errors.TypeMismatch):
+        StrictDoc.from_son(broken)
+    with pytest.raises(errors.FieldNotFound):
+        StrictDoc.from_son({'other': 5})
+
+
+@pytest.mark.asyncio
+async def test_update_projection(db_config, database):
+    connection.Connection.connect(**db_config)
+    coll = database['UpdateDoc']
+
+    class UpdateDoc(BaseDocument):
+        num = fields.IntField()
+        mapping = fields.MapField(fields.IntField())
+        nums = fields.ListField(fields.IntField())
+        payload = fields.ListField(fields.IntField())
+
+    doc = UpdateDoc(
+        num=0, mapping={'a': 1}, nums=[1, 2, 3], payload=list(range(100)))
+    await doc.save()
+
+    other = await UpdateDoc.get_object(id=doc.id)
+    other.num = 5
+    other.mapping['a'] = 5
+    other.nums[1] = 5
+    await other.save()
+
+    doc.num = 10
+    doc.mapping['a'] = 10
+    doc.nums[1] = 10
+    doc.nums.append(4)
+    assert utils.projection(doc._dirty_paths()) == {
+        'num': 1, 'mapping.a': 1, 'nums': 1}
+
+    await doc.save(limit=2)
+    stored = coll.find_one()
+    assert stored['num'] == 10
+    assert stored['mapping'] == {'a': 10}
+    assert stored['nums'] == [1, 10, 3, 4]
+    assert stored['payload'] == list(range(100))
+
+
+@pytest.mark.asyncio
+async def test_versioned_save(db_config, database):
+    connection.Connection.connect(**db_config)
+    coll = database['VersionDoc']
+
+    class VersionDoc(BaseDocument, versioned=True):
+        num = fields.IntField(default=0)
+        name = fields.StringField()
+        nums = fields.ListField(fields.IntField())
+
+    doc = VersionDoc(name='a', nums=[1, 2, 3])
+    await doc.save()
+    assert coll.find_one()['_version'] == 1
+
+    stale = await VersionDoc.get_object(id=doc.id)
+    doc.name = 'b'
+    doc.num = Inc(1)
+    await doc.save()
+    assert coll.find_one()['_version'] == 2
+
+    # the stale copy is reloaded and its changes are applied again
+    stale.num = Inc(5)
+    stale.nums.append(4)
+    del stale.nums[0]
+    await stale.save()
+    assert stale.name == 'b'
+    assert stale.num == 6
+    assert stale.nums == [2, 3, 4]
+
+    stored = coll.find_one()
+    assert stored['name'] == 'b'
+    assert stored['num'] == 6
+    assert stored['nums'] == [2, 3, 4]
+    assert stored['_version'] == stale._version == 3
+
+    # independent changes are sent as a single update
+    stale.name = 'c'
+    stale.num = Inc(1)
+    stale.nums.append(5)
+    assert len(stale._build_versioned_queries()) == 1
+    await stale.save()
+    stored = coll.find_one()
+    assert stored['nums'] == [2, 3, 4, 5]
+    assert stored['_version'] == stale._version == 4
+
+    doc.nums = [7]
+    with pytest.raises(errors.RetryLimitReached):
+        await doc.save(limit=1)
+
+    await doc.save()
+    assert coll.find_one()['nums'] == [7]
+    assert coll.find_one()['_version'] == doc._version
+
+
+@pytest.mark.asyncio
+async def test_write_options(db_config, database):
+    connection.Connection.connect(**db_config)
+    coll = database['TelemetryDoc']
+
+    class TelemetryDoc(
+            BaseDocument, write_concern={'w': 1, 'j': False}, ordered=False,
+            bypass_document_validation=True):
+        num = fields.IntField(default=0)
+        name = fields.StringField()
+
+    doc = TelemetryDoc(name='a')
+    await doc.save()
+    coll_options = TelemetryDoc._get_write_collection()
+    assert coll_options.write_concern.document == {'w': 1, 'j': False}
+
+    doc.num = Inc(1)
+    doc.name = 'b'
+    await doc.save(write_concern={'w': 'majority'}, ordered=True)
+    stored = coll.find_one()
+    assert stored['num'] == 1
+    assert stored['name'] == 'b'
+
+    doc.num = Inc(1)
+    with pytest.raises(ValueError):
+        await doc.save(write_concern={'w': 0}, atomic=True)
+
+    with pytest.raises(errors.TypeMismatch):
+        await doc.save(write_concern='majority')
+
+
+@pytest.mark.asyncio
+async def test_bypass_validation(db_config, database, monkeypatch):
+    connection.Connection.connect(**db_config)
+
+    class BypassDoc(
+            BaseDocument, versioned=True, bypass_document_validation=True):
+        num = fields.IntField(default=0)
+        nums = fields.ListField(fields.IntField())
+
+    calls = []
+    get_collection = BypassDoc._get_write_collection.__func__
+
+    def recording_collection(cls, write_concern=None):
+        coll = get_collection(cls, write_concern)
+        bulk_write = coll.bulk_write
+        find_one_and_update = coll.find_one_and_update
+
+        def recording_bulk_write(*args, **kwargs):
+            calls.append(kwargs.get('bypass_document_validation'))
+            return bulk_write(*args, **kwargs)
+
+        def recording_find_one_and_update(*args, **kwargs):
+            calls.append(kwargs.pop('bypassDocumentValidation', None))
+            return find_one_and_update(*args, **kwargs)
+
+        coll.bulk_write = recording_bulk_write
+        coll.find_one_and_update = recording_find_one_and_update
+        return coll
+
+    monkeypatch.setattr(
+        BypassDoc, '_get_write_collection',
+        classmethod(recording_collection))
+
+    doc = BypassDoc(nums=[1, 2])
+    await doc.save()
+
+    doc.nums.append(3)
+    del doc.nums[0]
+    await doc.save()
+    doc.num = Inc(1)
+    await doc.save(atomic=True)
+    await BypassDoc.upsert({'num': 5}, nums=[1])
+    await BypassDoc.get_or_create(num=6)
+    buffer = WriteBuffer(interval=None)
+    buffer.add(doc, 'num', Inc(1))
+    await buffer.flush()
+
+    assert calls == [True] * 5
+    assert database['BypassDoc'].find_one({'_id': doc.id})['nums'] == [2, 3]
@@ -0,0 +1,63 @@
+import pytest
+import pymongo
+from motorturbine import BaseDocument, fields, errors, connection
+from motorturbine.indexes import Index, ensure_indexes
+from motorturbine.queryset import Gt
+from pymongo import errors as pymongo_errors
+
+
+@pytest.mark.asyncio
+async def test_declared_indexes(db_config, database):
+    connection.Connection.connect(**db_config)
+
+    class IndexDoc(BaseDocument):
+        name = fields.StringField(unique=True)
+        num = fields.IntField()
+        stamp = fields.DateTimeField()
+
+        num_name = Index('num', ('name', pymongo.DESCENDING))
+        sparse_num = Index('num', sparse=True)
+        partial_num = Index('name', partial={'num': Gt(5)})
+        expiry = Index('stamp', expire_after=3600)
+
+    result = await IndexDoc.ensure_indexes()
+    assert result['existing'] == []
+    assert sorted(result['created']) == [
+        'expiry', 'name_1', 'num_name', 'partial_num', 'sparse_num']
+
+    info = database['IndexDoc'].index_information()
+    assert info['name_1']['unique']
+    assert list(info['num_name']['key']) == [('num', 1), ('name', -1)]
+    assert info['sparse_num']['sparse']
+    assert info['partial_num']['partialFilterExpression'] == {
+        'num': {'$gt': 5}}
+    assert info['expiry']['expireAfterSeconds'] == 3600
+
+    result = await IndexDoc.ensure_indexes()
+    assert result['created'] == []
+    assert len(result['existing']) == 5
+
+
+@pytest.mark.asyncio
+async def test_ensure_indexes(db_config, database):
+    connection.Connection.connect(**db_config)
+
+    class UniqueDoc(BaseDocument):
+        num = fields.IntField(unique=True)
+
+    class OtherDoc(UniqueDoc):
+        other = fields.IntField()
+
+        by_other = Index('other')
+
+    doc = UniqueDoc(num=1)
+    await doc.save()
+    assert 'num_1' not in database['UniqueDoc'].index_information()
+
+    result = await ensure_indexes(UniqueDoc, OtherDoc)
+    assert result['UniqueDoc'] == {'created': ['num_1'], 'existing': []}
+    assert result['OtherDoc'] == {
+        'created': ['num_1', 'by_other'], 'existing': []}
+
+    with pytest.raises(pymongo_errors.DuplicateKeyError):
+        await UniqueDoc(num=1).save()
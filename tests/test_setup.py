@@ -13,3 +13,41 @@ def test_failingdoc():
 def test_subdoc():
     class TestDocument(BaseDocument):
         x = fields.BaseField()
+
+
+def test_schema():
+    with pytest.raises(errors.FieldExpected):
+        class FailingDocument(BaseDocument):
+            y = int
+
+    class ParentDocument(BaseDocument):
+        x = fields.IntField()
+
+        def method(self):
+            return self.x
+
+    class ChildDocument(ParentDocument):
+        y = fields.StringField()
+
+    assert list(ParentDocument._schema) == ['id', 'x']
+    assert list(ChildDocument._schema) == ['id', 'x', 'y']
+
+
+def test_reserved_field_name():
+    with pytest.raises(errors.FieldNameReserved):
+        class FailingDocument(BaseDocument):
+            save = fields.IntField()
+
+
+def test_query_helper_field_name():
+    class Page(BaseDocument):
+        count = fields.IntField(default=0)
+        load = fields.StringField()
+
+    assert list(Page._schema) == ['id', 'count', 'load']
+    assert Page.count is Page._schema['count']
+
+    page = Page(count=3)
+    page.count = 5
+    assert page.count == 5
+    assert page.load is None
@@ -0,0 +1,146 @@
+import pytest
+from motorturbine import BaseDocument, fields, errors, connection, unit_of_work
+from motorturbine.updateset import Inc
+
+
+@pytest.mark.asyncio
+async def test_unit_of_work(db_config, database):
+    connection.Connection.connect(**db_config)
+
+    class Order(BaseDocument):
+        status = fields.StringField()
+        items = fields.ListField(fields.IntField())
+
+    class Customer(BaseDocument):
+        orders = fields.IntField(default=0)
+
+    orders = [Order(status='open', items=[1]) for _ in range(3)]
+    for order in orders:
+        await order.save()
+    customer = Customer()
+    await customer.save()
+
+    async with unit_of_work():
+        for order in orders:
+            order.status = 'shipped'
+            order.items.append(2)
+        customer.orders = Inc(len(orders))
+        new_order = Order(status='new')
+
+    for order in orders:
+        assert order._get_sync_fields() == []
+    assert new_order.id is None
+
+    stored = list(database['Order'].find())
+    assert len(stored) == 3
+    for data in stored:
+        assert data['status'] == 'shipped'
+        assert data['items'] == [1, 2]
+    assert database['Customer'].find_one()['orders'] == 3
+
+
+@pytest.mark.asyncio
+async def test_unit_of_work_conflict(db_config, database):
+    connection.Connection.connect(**db_config)
+
+    class Document(BaseDocument):
+        num = fields.IntField()
+        counter = fields.IntField(default=0)
+
+    doc1 = Document(num=1)
+    await doc1.save()
+    doc2 = Document(num=2)
+    await doc2.save()
+
+    stale = await Document.get_object(id=doc1.id)
+    doc1.num = 10
+    await doc1.save()
+
+    async with unit_of_work():
+        stale.num = Inc(5)
+        doc2.counter = Inc(1)
+
+    # only the conflicting document is written again
+    assert database['Document'].find_one({'_id': doc1.id})['num'] == 15
+    assert database['Document'].find_one({'_id': doc2.id})['counter'] == 1
+    assert stale._get_sync_fields() == []
+
+    stale = await Document.get_object(id=doc1.id)
+    doc1.num = 20
+    await doc1.save()
+
+    with pytest.raises(errors.RetryLimitReached):
+        async with unit_of_work(limit=1):
+            stale.num = Inc(5)
+
+    # another increment that leads to the same value is not mistaken
+    # for the own one
+    stale = await Document.get_object(id=doc1.id)
+    doc1.num = Inc(1)
+    await doc1.save()
+    async with unit_of_work():
+        stale.num = Inc(1)
+    assert database['Document'].find_one({'_id': doc1.id})['num'] == 22
+
+    # assigned values that conflict are written again
+    stale = await Document.get_object(id=doc1.id)
+    other = await Document.get_object(id=doc2.id)
+    doc1.num = 30
+    await doc1.save()
+    async with unit_of_work():
+        stale.num = 40
+        other.num = 50
+    assert database['Document'].find_one({'_id': doc1.id})['num'] == 40
+    assert database['Document'].find_one({'_id': doc2.id})['num'] == 50
+    assert stale._get_sync_fields() == []
+
+
+@pytest.mark.asyncio
+async def test_unit_of_work_error(db_config, database):
+    connection.Connection.connect(**db_config)
+
+    class Document(BaseDocument):
+        num = fields.IntField()
+
+    doc = Document(num=1)
+    await doc.save()
+
+    with pytest.raises(ValueError):
+        async with unit_of_work():
+            doc.num = 5
+            raise ValueError()
+
+    assert database['Document'].find_one()['num'] == 1
+    assert doc._get_sync_fields() == ['num']
+
+
+@pytest.mark.asyncio
+async def test_unit_of_work_versioned(db_config, database):
+    connection.Connection.connect(**db_config)
+    coll = database['VersionDoc']
+
+    class VersionDoc(BaseDocument, versioned=True):
+        num = fields.IntField(default=0)
+        nums = fields.ListField(fields.IntField())
+
+    docs = [VersionDoc(nums=[1]) for _ in range(2)]
+    for doc in docs:
+        await doc.save()
+
+    stale = await VersionDoc.get_object(id=docs[0].id)
+    docs[0].num = 3
+    await docs[0].save()
+
+    # the stale document is reloaded and its changes are applied again
+    async with unit_of_work():
+        stale.num = Inc(1)
+        stale.nums.append(2)
+        docs[1].num = Inc(2)
+
+    first = coll.find_one({'_id': docs[0].id})
+    assert first['num'] == stale.num == 4
+    assert first['nums'] == [1, 2]
+    assert first['_version'] == stale._version == 3
+    second = coll.find_one({'_id': docs[1].id})
+    assert second['num'] == 2
+    assert second['_version'] == docs[1]._version == 2
@@ -1,6 +1,6 @@
 import pytest
 from motorturbine import BaseDocument, fields, errors, connection
-from motorturbine.updateset import Inc, Dec, Max, Min, Mul
+from motorturbine.updateset import Inc, Dec, Max, Min, Mul, Push
 
 
 @pytest.mark.asyncio
@@ -187,3 +187,100 @@ async def test_multiple(db_config, database):
     assert doc.num == 13
 
     await doc.save()
+
+
+@pytest.mark.asyncio
+async def test_atomic(db_config, database):
+    connection.Connection.connect(**db_config)
+    coll = database['Document']
+
+    class Document(BaseDocument):
+        num = fields.IntField()
+        name = fields.StringField()
+        mapping = fields.MapField(fields.IntField())
+        nums = fields.ListField(fields.IntField())
+
+    doc = Document(num=0, name='a', mapping={'a': 1, 'b': 2}, nums=[1])
+    await doc.save()
+    other = await Document.get_object(id=doc.id)
+
+    doc.num = Inc(5)
+    await doc.save(atomic=True)
+
+    # the stale document is not retried and receives the stored value
+    other.num = Inc(1)
+    other.mapping['a'] = Max(10)
+    other.nums.append(2)
+    await other.save(limit=1, atomic=True)
+    assert other.num == 6
+    assert other.mapping == {'a': 10, 'b': 2}
+    assert other.nums == [1, 2]
+    assert other._get_sync_fields() == []
+
+    stored = coll.find_one()
+    assert stored['num'] == 6
+    assert stored['mapping'] == {'a': 10, 'b': 2}
+    assert stored['nums'] == [1, 2]
+
+    # other changes are still saved with conditions
+    doc.name = 'b'
+    doc.mapping['b'] = 3
+    doc.num = Inc(1)
+    await doc.save(atomic=True)
+    assert doc.num == 7
+    assert doc.mapping == {'a': 1, 'b': 3}
+
+    stored = coll.find_one()
+    assert stored['name'] == 'b'
+    assert stored['num'] == 7
+    assert stored['mapping'] == {'a': 10, 'b': 3}
+
+
+@pytest.mark.asyncio
+async def test_compaction(db_config, database):
+    connection.Connection.connect(**db_config)
+    coll = database['Document']
+
+    class Document(BaseDocument):
+        num = fields.IntField()
+        high = fields.IntField()
+        nums = fields.ListField(fields.IntField())
+
+    doc = Document(num=0, high=0, nums=[])
+    await doc.save()
+
+    for _ in range(100):
+        doc.num = Inc(2)
+    doc.num = Dec(50)
+    doc.high = Max(3)
+    doc.high = Max(7)
+    doc.high = Max(5)
+    doc.nums = Push(1)
+    doc.nums = Push([2, 3], each=True)
+    assert doc.num == 150
+    assert doc.high == 7
+
+    # every field is saved with a single operator
+    assert len(doc._get_updates('num')) == 1
+    assert len(doc._get_updates('high')) == 1
+    assert len(doc._get_updates('nums')) == 1
+    assert len(doc._build_updates()) == 1
+
+    await doc.save()
+    result = coll.find_one()
+    assert result['num'] == 150
+    assert result['high'] == 7
+    assert result['nums'] == [1, 2, 3]
+
+    # changes after a set become part of the set value
+    doc.num = 10
+    doc.num = Inc(5)
+    doc.nums = [4]
+    doc.nums = Push(5)
+    assert len(doc._get_updates('num')) == 1
+    assert len(doc._get_updates('nums')) == 1
+
+    await doc.save()
+    result = coll.find_one()
+    assert result['num'] == 15
+    assert result['nums'] == [4, 5]